@@ -0,0 +1,78 @@
+# answer_cache.py
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from chunk_store import chunk_key
+
+
+class SemanticAnswerCache:
+    """
+    Reuse LLM answers for near-duplicate questions. A cached answer is served when
+    the new question's embedding has cosine similarity >= threshold with a cached
+    question AND retrieval returned exactly the same chunks, so an answer is never
+    reused for different evidence. Entries expire after ttl_seconds, the least
+    recently used are evicted past max_entries, and everything is dropped when the
+    index generation changes (i.e. the DB was rebuilt).
+    """
+
+    def __init__(self, threshold=0.95, ttl_seconds=3600, max_entries=1000):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._entries = OrderedDict()   # id -> (unit query vector, chunk keys, answer, created, latency)
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _check_generation(self, generation):
+        if generation != self.generation:
+            self._entries.clear()
+            self.generation = generation
+
+    def _expire(self, now):
+        for entry_id in [i for i, entry in self._entries.items() if now - entry[3] > self.ttl_seconds]:
+            del self._entries[entry_id]
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype="float32")
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, query_vector, docs, generation):
+        """Return a cached answer for this question + retrieved chunk set, or None."""
+        chunk_keys = frozenset(chunk_key(doc) for doc in docs)
+        with self._lock:
+            self._check_generation(generation)
+            self._expire(time.time())
+            candidates = [(i, entry) for i, entry in self._entries.items() if entry[1] == chunk_keys]
+            if candidates:
+                similarities = np.stack([entry[0] for _, entry in candidates]) @ self._unit(query_vector)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id, entry = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    self.saved_seconds += entry[4]
+                    return entry[2]
+            self.misses += 1
+            return None
+
+    def store(self, query_vector, docs, answer, latency_seconds, generation):
+        chunk_keys = frozenset(chunk_key(doc) for doc in docs)
+        with self._lock:
+            self._check_generation(generation)
+            self._entries[self._next_id] = (self._unit(query_vector), chunk_keys, answer, time.time(), latency_seconds)
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0, "saved_seconds": self.saved_seconds,
+        }
@@ -0,0 +1,66 @@
+# answer_stream.py
+import re
+import provider_gateway
+
+
+def clean_answer(answer: str) -> str:
+    # Remove only page references like (p. 123)
+    answer = re.sub(r'\(.*?\bp\.?\s*\d+.*?\)', '', answer, flags=re.IGNORECASE)
+    # Remove "Source:" lines
+    answer = re.sub(r'(?mi)^\s*source[s]?:.*$', '', answer)
+    # Remove inline "Source: ..." text
+    answer = re.sub(r'(?i)\s*source[s]?:.*', '', answer)
+    # Collapse extra whitespace
+    answer = re.sub(r'\n{2,}', '\n', answer).strip()
+    answer = re.sub(r'[ \t]{2,}', ' ', answer).strip()
+    return answer
+
+
+class StreamingCleaner:
+    """
+    Apply clean_answer to a streamed answer as it grows. Only the part of the
+    raw text that later tokens can no longer change is cleaned: text from the
+    first "(" on the current line (a page reference may be coming) and the
+    trailing partial word (it may become "Source:") are held back. update()
+    returns the newly safe cleaned text; finish() returns whatever is left
+    once the stream ends.
+    """
+
+    def __init__(self):
+        self.emitted = ""
+
+    @staticmethod
+    def _safe_end(raw):
+        raw = raw[:re.search(r"\S*$", raw).start()]
+        # A page reference can start at any "(" on the current line ("." does not match a newline)
+        open_paren = raw.find("(", raw.rfind("\n") + 1)
+        return open_paren if open_paren != -1 else len(raw)
+
+    def _advance(self, cleaned):
+        if not cleaned.startswith(self.emitted):
+            return ""
+        new_text = cleaned[len(self.emitted):]
+        self.emitted = cleaned
+        return new_text
+
+    def update(self, raw):
+        return self._advance(clean_answer(raw[:self._safe_end(raw)]))
+
+    def finish(self, raw):
+        return self._advance(clean_answer(raw) or raw.strip())
+
+
+def stream_completion(on_text, **request):
+    """
+    Run a streaming Groq chat completion through the provider gateway, calling
+    on_text(text so far) for every content delta. Returns (full text, usage);
+    usage is None if the provider did not report it.
+    """
+    text, usage = "", None
+    for chunk in provider_gateway.chat_completion(stream=True, **request):
+        if chunk.choices and chunk.choices[0].delta.content:
+            text += chunk.choices[0].delta.content
+            on_text(text)
+        # Groq reports token usage on the final chunk under x_groq
+        usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+    return text, usage
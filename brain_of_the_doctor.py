@@ -1,21 +1,50 @@
 # brain_of_the_doctor.py
-import os
-from groq import Groq
+import io
+from PIL import Image, ImageOps
+import provider_gateway
+
+VISION_MAX_SIDE = 1024          # Longest side sent to the vision model; phone photos are 3-4x this
+VISION_JPEG_QUALITY = 85
+THUMBNAIL_SIZE = (250, 250)     # Chat bubble preview
+
+def encode_image_bytes(image_bytes) -> str:
+    """Return base64-encoded data URI content for in-memory image bytes (bytes or memoryview)."""
+    import base64
+    return base64.b64encode(image_bytes).decode("utf-8")
+
+def _jpeg_b64(image, quality: int) -> str:
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", optimize=True, quality=quality)
+    return encode_image_bytes(buffered.getbuffer())
+
+def prepare_image(image, max_side: int = VISION_MAX_SIDE, quality: int = VISION_JPEG_QUALITY,
+                  thumbnail_size=THUMBNAIL_SIZE):
+    """
+    Decode an uploaded PIL image once and return (model payload, UI thumbnail) as
+    base64 JPEGs. JPEGs are decoded straight at reduced scale when possible, the
+    payload is bounded to max_side, and the thumbnail is cut from the same pixels.
+    """
+    if image.format == "JPEG":
+        image.draft("RGB", (max_side, max_side))   # Only takes effect before the pixels are loaded
+    image = ImageOps.exif_transpose(image)         # Phone photos store their rotation in EXIF
+    if image.mode != "RGB":
+        image = image.convert("RGB")               # JPEG has no alpha / palette
+    model_image = image.copy()
+    model_image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    thumbnail = model_image.copy()
+    thumbnail.thumbnail(thumbnail_size, Image.Resampling.LANCZOS)
+    return _jpeg_b64(model_image, quality), _jpeg_b64(thumbnail, 85)
 
 def encode_image(image_path: str) -> str:
     """Return base64-encoded data URI content for an image file path."""
-    import base64
     with open(image_path, "rb") as f:
-        encoded = base64.b64encode(f.read()).decode("utf-8")
-    return encoded
+        return encode_image_bytes(f.read())
 
 def analyze_image_with_query(query: str, encoded_image: str, model: str = "meta-llama/llama-4-scout-17b-16e-instruct"):
     """
     Ask Groq to analyze an image together with text.
     Returns textual answer string from the model.
     """
-    api_key = os.getenv("GROQ_API_KEY")
-    client = Groq(api_key=api_key) if api_key else Groq()
     messages = [
         {
             "role": "user",
@@ -28,5 +57,5 @@ def analyze_image_with_query(query: str, encoded_image: str, model: str = "meta-
             ],
         }
     ]
-    resp = client.chat.completions.create(messages=messages, model=model)
+    resp = provider_gateway.chat_completion(messages=messages, model=model)
     return resp.choices[0].message.content.strip()
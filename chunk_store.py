@@ -0,0 +1,306 @@
+# chunk_store.py
+import os
+import re
+import glob
+import json
+import zlib
+import sqlite3
+import threading
+from collections import Counter
+from collections.abc import Mapping
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+from lexical_index import LexicalIndex
+
+CHUNK_STORE_FILE = "chunks.sqlite"   # Chunk metadata, text offsets + FAISS position map, next to the index
+ZDICT_SIZE = 32 * 1024               # zlib's maximum preset dictionary size
+COMPACT_GARBAGE_RATIO = 0.5          # Rewrite text segments once half their bytes belong to deleted chunks
+
+
+def chunk_key(doc):
+    """Stable identity of a retrieved chunk, independent of docstore ids."""
+    metadata = doc.metadata
+    return (metadata.get("book_title"), metadata.get("page"), metadata.get("start_index"))
+
+
+def train_dictionary(texts, size=ZDICT_SIZE):
+    """
+    Build a zlib preset dictionary from the most frequent words in texts. zlib
+    favours the end of the dictionary, so the most frequent words go last.
+    """
+    counts = Counter(word for text in texts for word in re.findall(r"[A-Za-z][A-Za-z\-]{3,}", text))
+    words, used = [], 0
+    for word, _ in counts.most_common():
+        used += len(word) + 1
+        if used > size:
+            break
+        words.append(word)
+    return " ".join(reversed(words)).encode("utf-8")
+
+
+def segment_files(chunk_file):
+    return glob.glob(glob.escape(os.path.splitext(chunk_file)[0]) + ".*.bin")
+
+
+def remove_chunk_store(chunk_file):
+    for stale_file in [chunk_file, chunk_file + "-wal", chunk_file + "-shm", *segment_files(chunk_file)]:
+        if os.path.exists(stale_file):
+            os.remove(stale_file)
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Pickle-free LangChain docstore. Chunk texts are zlib-compressed one by one
+    with a shared preset dictionary and appended to a text segment file
+    (chunks.<n>.bin); SQLite holds each chunk's metadata and (segment, offset,
+    length). A search decompresses only the chunks it hits, so opening the store
+    costs nothing and readers in different processes share pages through the
+    OS page cache. A BM25 inverted index over the same chunks lives in the
+    same file (see lexical_index.py) and is maintained on every add/delete.
+    Writes stay in one open transaction until save_positions() commits them
+    together with the FAISS position map, so a crash rolls back to the last save.
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self._local = threading.local()
+        self._fds = {}
+        self._fd_lock = threading.Lock()
+        self._zdict = None
+        self._writer = None
+        self.lexical = LexicalIndex(self._conn)
+        if not read_only:
+            conn = self._conn()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " id TEXT PRIMARY KEY, book_title TEXT, segment INTEGER NOT NULL,"
+                " offset INTEGER NOT NULL, length INTEGER NOT NULL, metadata TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_book_title ON chunks (book_title)")
+            conn.execute("CREATE TABLE IF NOT EXISTS positions (pos INTEGER PRIMARY KEY, id TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+            LexicalIndex.create_tables(conn)
+            conn.commit()
+            self._backfill_lexical()
+
+    def _conn(self):
+        # One connection per thread: Streamlit serves sessions from several threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.read_only:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            else:
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    # ---------------- Text segments ----------------
+    def _segment_file(self, segment):
+        return f"{os.path.splitext(self.path)[0]}.{segment}.bin"
+
+    def _dictionary(self, sample_texts=None):
+        if self._zdict is None:
+            row = self._conn().execute("SELECT value FROM meta WHERE key = 'zdict'").fetchone()
+            if row:
+                self._zdict = bytes(row[0])
+            elif sample_texts is not None:
+                # First write: the dictionary is trained once and never changes afterwards
+                self._zdict = train_dictionary(sample_texts)
+                self._conn().execute("INSERT INTO meta VALUES ('zdict', ?)", (self._zdict,))
+        return self._zdict
+
+    def _read_text(self, segment, offset, length):
+        with self._fd_lock:
+            fd = self._fds.get(segment)
+            if fd is None:
+                fd = self._fds[segment] = os.open(self._segment_file(segment), os.O_RDONLY)
+        decompressor = zlib.decompressobj(zdict=self._dictionary())
+        return decompressor.decompress(os.pread(fd, length, offset)).decode("utf-8")
+
+    def _open_writer(self, segment=None):
+        if segment is None:
+            segment = self._conn().execute("SELECT COALESCE(MAX(segment), 0) FROM chunks").fetchone()[0]
+        if self._writer:
+            self._writer[1].close()
+        self._writer = (segment, open(self._segment_file(segment), "ab"))
+        return self._writer
+
+    def _compress(self, text):
+        compressor = zlib.compressobj(level=9, zdict=self._dictionary())
+        return compressor.compress(text.encode("utf-8")) + compressor.flush()
+
+    # ---------------- Docstore API used by LangChain's FAISS ----------------
+    def search(self, search):
+        row = self._conn().execute(
+            "SELECT segment, offset, length, metadata FROM chunks WHERE id = ?", (search,)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=self._read_text(*row[:3]), metadata=json.loads(row[3]))
+
+    def add(self, texts):
+        self._dictionary(sample_texts=[doc.page_content for doc in texts.values()])
+        # Replaced ids get a new rowid, so drop their old postings first
+        replaced = self.existing_ids(list(texts))
+        if replaced:
+            self.delete(list(replaced))
+        segment, segment_file = self._writer or self._open_writer()
+        conn = self._conn()
+        indexed = []
+        for doc_id, doc in texts.items():
+            blob = self._compress(doc.page_content)
+            offset = segment_file.tell()
+            segment_file.write(blob)
+            cursor = conn.execute("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?)", (
+                doc_id, doc.metadata.get("book_title"), segment, offset, len(blob),
+                json.dumps(doc.metadata, default=str)
+            ))
+            indexed.append((cursor.lastrowid, doc.page_content))
+        self.lexical.add(indexed)
+
+    def delete(self, ids):
+        # Deleted texts stay in their segment as garbage until the next compaction
+        conn = self._conn()
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            placeholders = ','.join('?' * len(part))
+            rowids = conn.execute(f"SELECT rowid FROM chunks WHERE id IN ({placeholders})", part)
+            self.lexical.delete([row[0] for row in rowids.fetchall()])
+            conn.execute(f"DELETE FROM chunks WHERE id IN ({placeholders})", part)
+
+    # ---------------- Lexical (BM25) search ----------------
+    def _backfill_lexical(self):
+        # Stores written before the inverted index existed get it on the next ingestion run
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT rowid, segment, offset, length FROM chunks WHERE rowid NOT IN (SELECT doc FROM lexical_docs)"
+        ).fetchall()
+        if rows:
+            print(f"🔤 Building BM25 index for {len(rows)} existing chunks")
+            self.lexical.add((rowid, self._read_text(*location)) for rowid, *location in rows)
+            conn.commit()
+
+    def lexical_search(self, query, k):
+        """Return up to k (Document, BM25 score) pairs, best first."""
+        try:
+            hits = self.lexical.search(query, k)
+        except sqlite3.OperationalError:
+            return []   # Store built before the inverted index existed
+        results = []
+        for rowid, score in hits:
+            row = self._conn().execute(
+                "SELECT segment, offset, length, metadata FROM chunks WHERE rowid = ?", (rowid,)
+            ).fetchone()
+            if row:
+                results.append((Document(page_content=self._read_text(*row[:3]), metadata=json.loads(row[3])), score))
+        return results
+
+    # ---------------- Book-level helpers for ingestion ----------------
+    def book_titles(self):
+        return {row[0] for row in self._conn().execute("SELECT DISTINCT book_title FROM chunks")}
+
+    def ids_for_books(self, book_titles):
+        book_titles = list(book_titles)
+        if not book_titles:
+            return []
+        rows = self._conn().execute(
+            f"SELECT id FROM chunks WHERE book_title IN ({','.join('?' * len(book_titles))})", book_titles
+        )
+        return [row[0] for row in rows]
+
+    def existing_ids(self, ids):
+        found = set()
+        conn = self._conn()
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            rows = conn.execute(f"SELECT id FROM chunks WHERE id IN ({','.join('?' * len(part))})", part)
+            found.update(row[0] for row in rows)
+        return found
+
+    # ---------------- Compaction ----------------
+    def _compact(self):
+        """Copy live texts into a new segment; returns the segment files that became unused."""
+        conn = self._conn()
+        old_files = segment_files(self.path)
+        live_bytes = conn.execute("SELECT COALESCE(SUM(length), 0) FROM chunks").fetchone()[0]
+        total_bytes = sum(os.path.getsize(f) for f in old_files)
+        if not total_bytes or live_bytes >= total_bytes * (1 - COMPACT_GARBAGE_RATIO):
+            return []
+
+        new_segment = conn.execute("SELECT COALESCE(MAX(segment), -1) + 1 FROM chunks").fetchone()[0]
+        if self._writer:
+            self._writer[1].close()
+            self._writer = None
+        updates = []
+        with open(self._segment_file(new_segment), "wb") as out:
+            rows = conn.execute("SELECT id, segment, offset, length FROM chunks ORDER BY segment, offset").fetchall()
+            for doc_id, segment, offset, length in rows:
+                with self._fd_lock:
+                    fd = self._fds.get(segment) or os.open(self._segment_file(segment), os.O_RDONLY)
+                    self._fds[segment] = fd
+                updates.append((new_segment, out.tell(), doc_id))
+                out.write(os.pread(fd, length, offset))
+            out.flush()
+            os.fsync(out.fileno())
+        conn.executemany("UPDATE chunks SET segment = ?, offset = ? WHERE id = ?", updates)
+        return [f for f in old_files if f != self._segment_file(new_segment)]
+
+    # ---------------- FAISS position -> docstore id map ----------------
+    def load_positions(self):
+        return dict(self._conn().execute("SELECT pos, id FROM positions"))
+
+    def index_file(self):
+        """Name of the FAISS index file committed together with the current position map."""
+        try:
+            row = self._conn().execute("SELECT value FROM meta WHERE key = 'index_file'").fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return row[0] if row else None
+
+    def save_positions(self, index_to_docstore_id, index_file=None):
+        """
+        Replace the position map and commit every pending chunk write with it,
+        compacting the text segments first if deletions left too much garbage.
+        index_file records which FAISS index file these positions belong to.
+        """
+        if self._writer:
+            self._writer[1].flush()
+            os.fsync(self._writer[1].fileno())
+        unused_files = self._compact()
+
+        conn = self._conn()
+        conn.execute("DELETE FROM positions")
+        conn.executemany("INSERT INTO positions VALUES (?, ?)", index_to_docstore_id.items())
+        if index_file:
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('index_file', ?)", (index_file,))
+        conn.commit()
+
+        # Old segments are only removed after the commit that stopped referencing them
+        with self._fd_lock:
+            for segment, fd in list(self._fds.items()):
+                if self._segment_file(segment) in unused_files:
+                    os.close(fd)
+                    del self._fds[segment]
+        for unused_file in unused_files:
+            os.remove(unused_file)
+
+
+class PositionMap(Mapping):
+    """Read-only, lazily queried FAISS position -> docstore id map."""
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+
+    def __getitem__(self, pos):
+        row = self.docstore._conn().execute("SELECT id FROM positions WHERE pos = ?", (int(pos),)).fetchone()
+        if row is None:
+            raise KeyError(pos)
+        return row[0]
+
+    def __len__(self):
+        return self.docstore._conn().execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+
+    def __iter__(self):
+        return (row[0] for row in self.docstore._conn().execute("SELECT pos FROM positions ORDER BY pos"))
@@ -3,37 +3,48 @@
 # Updated version: safer cleaning, similarity scores, better error handling
 
 import os
-import re
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from groq import Groq
+from embedding_cache import CachedEmbeddings, normalize_query
+from memory_store import index_generation, load_vectorstore, mmr_search_by_vector
+from reranker import CrossEncoderReranker
+from context_packer import pack_context
+from answer_stream import StreamingCleaner, clean_answer, stream_completion
 
 # ---------------- CONFIG ----------------
 DB_FAISS_PATH = "vectorstore/db_faiss"
 TOP_K = 5
+MMR_LAMBDA = 0.7        # Relevance vs diversity of retrieved chunks (1.0 = plain nearest neighbours)
 MAX_OUTPUT_TOKENS = 800
 TEMPERATURE = 0.3
-
-# ---------------- INIT GROQ CLIENT ----------------
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-print("✅ Groq client initialized successfully")
+RERANK_ENABLED = True   # Re-score over-fetched candidates with a local cross-encoder
+RERANK_FETCH_K = 20     # Candidates handed to the reranker
+RERANK_TOP_K = 3        # Chunks kept for the prompt
+RERANK_BUDGET_MS = 200  # Past this the candidates keep their bi-encoder order
+CONTEXT_TOKEN_BUDGET = 1200  # Tokens of retrieved text packed into the prompt
 
 # ---------------- STEP 1: Load FAISS DB ----------------
-embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+embedding_model = CachedEmbeddings(
+    HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2"), query_key=normalize_query
+)
 
 if not os.path.exists(DB_FAISS_PATH):
     raise ValueError("❌ FAISS DB not found! Please run create_memory_for_llm.py first.")
 
-db = FAISS.load_local(DB_FAISS_PATH, embedding_model, allow_dangerous_deserialization=True)
+db = load_vectorstore(DB_FAISS_PATH, embedding_model)
+db_generation = index_generation(DB_FAISS_PATH)
 print("✅ FAISS DB loaded successfully")
 
+reranker = CrossEncoderReranker(budget_ms=RERANK_BUDGET_MS) if RERANK_ENABLED else None
+
 # ---------------- Helper: build context prompt ----------------
 def build_context_prompt(question, docs):
     contexts = []
-    for i, doc in enumerate(docs, start=1):
+    packed_docs, context_tokens = pack_context(docs, CONTEXT_TOKEN_BUDGET)
+    print(f"🧮 Packed {len(packed_docs)} passages, ~{context_tokens} context tokens")
+    for i, doc in enumerate(packed_docs, start=1):
         page = doc.metadata.get("page", "N/A")
         book = doc.metadata.get("book_title", "Unknown Book")
-        text = doc.page_content.strip()[:800]
+        text = doc.page_content
         contexts.append(f"Source {i} ({book}, p. {page}): {text}")
     context_text = "\n\n".join(contexts)
 
@@ -46,19 +57,6 @@ Documents:
 """
     return prompt
 
-# ---------------- Helper: clean model answer ----------------
-def clean_answer(answer: str) -> str:
-    # Remove only page references like (p. 123)
-    answer = re.sub(r'\(.*?\bp\.?\s*\d+.*?\)', '', answer, flags=re.IGNORECASE)
-    # Remove "Source:" lines
-    answer = re.sub(r'(?mi)^\s*source[s]?:.*$', '', answer)
-    # Remove inline "Source: ..." text
-    answer = re.sub(r'(?i)\s*source[s]?:.*', '', answer)
-    # Collapse extra whitespace
-    answer = re.sub(r'\n{2,}', '\n', answer).strip()
-    answer = re.sub(r'[ \t]{2,}', ' ', answer).strip()
-    return answer
-
 # ---------------- STEP 2: Generate answer ----------------
 def generate_answer(prompt: str) -> str:
     system_message = {
@@ -73,17 +71,24 @@ def generate_answer(prompt: str) -> str:
     }
     user_message = {"role": "user", "content": prompt}
 
+    # Print the cleaned answer as it streams in
+    cleaner = StreamingCleaner()
+    print("\n💡 Answer:\n ", end="", flush=True)
     try:
-        response = groq_client.chat.completions.create(
+        raw, usage = stream_completion(
+            lambda text: print(cleaner.update(text), end="", flush=True),
             model="llama-3.3-70b-versatile",
             messages=[system_message, user_message],
             temperature=TEMPERATURE,
             max_completion_tokens=MAX_OUTPUT_TOKENS
         )
-        raw = response.choices[0].message.content
+        print(cleaner.finish(raw), flush=True)
+        if usage:
+            print(f"🧮 Prompt tokens: {usage.prompt_tokens}")
         cleaned = clean_answer(raw)
         return cleaned if cleaned else raw.strip()
     except Exception as e:
+        print(f"\n❌ Error generating response: {e}")
         return f"❌ Error generating response: {e}"
 
 # ---------------- STEP 3: Chat loop ----------------
@@ -97,17 +102,25 @@ while True:
         print("👋 Exiting bot. Stay healthy!")
         break
 
-    # Search with scores
-    docs_and_scores = db.similarity_search_with_score(question, k=TOP_K)
+    # A rebuild since the last question: reload so index and position map match
+    if index_generation(DB_FAISS_PATH) != db_generation:
+        db = load_vectorstore(DB_FAISS_PATH, embedding_model)
+        db_generation = index_generation(DB_FAISS_PATH)
+        print("🔄 FAISS DB changed on disk, reloaded")
+
+    # Search with scores, skipping near-duplicate neighbours of already picked chunks
+    k = RERANK_FETCH_K if reranker else TOP_K
+    docs_and_scores = mmr_search_by_vector(db, embedding_model.embed_query(question), k, fetch_k=2 * k, lambda_mult=MMR_LAMBDA)
     if not docs_and_scores:
         print("❌ No relevant documents found.")
         continue
+    if reranker:
+        docs_and_scores = reranker.rerank(question, docs_and_scores, k=RERANK_TOP_K)
 
     docs = [doc for doc, _ in docs_and_scores]
     prompt = build_context_prompt(question, docs)
 
     answer = generate_answer(prompt)
-    print("\n💡 Answer:\n", answer)
 
     # Show retrieved sources with similarity scores
     print(f"\n📚 Retrieved {len(docs_and_scores)} sources:")
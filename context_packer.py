@@ -0,0 +1,92 @@
+# context_packer.py
+import re
+from langchain_core.documents import Document
+
+CONTEXT_TOKEN_BUDGET = 1200     # Target size of the retrieved-context part of the prompt
+DUPLICATE_CONTAINMENT = 0.8     # Drop a chunk when this share of its word 3-grams is already packed
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\"'])")
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    # Words + punctuation: close to a BPE count for English prose and needs no tokenizer
+    return len(TOKEN_RE.findall(text))
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_RE.split(text) if sentence.strip()]
+
+
+def _whole_sentences(text):
+    """Sentences of a chunk, minus the fragments the splitter cut mid-sentence at either end."""
+    sentences = split_sentences(text)
+    if len(sentences) > 1 and sentences[0][0].islower():
+        sentences = sentences[1:]
+    if len(sentences) > 1 and not sentences[-1].endswith((".", "!", "?", ":")):
+        sentences = sentences[:-1]
+    return sentences
+
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+def _merge_neighbours(ranked_docs):
+    """
+    Join chunks from the same book and page into one passage, in page order,
+    dropping the text the splitter's overlap repeated. A passage ranks where
+    its best chunk ranked.
+    """
+    passages = {}   # (book, page) -> [rank, [(start, text), ...]]
+    for rank, doc in enumerate(ranked_docs):
+        key = (doc.metadata.get("book_title"), doc.metadata.get("page"))
+        if doc.metadata.get("start_index") is None:
+            key += (rank,)      # Without offsets the overlap cannot be located
+        passages.setdefault(key, [rank, [], doc.metadata])[1].append((doc.metadata.get("start_index") or 0, doc.page_content))
+
+    merged = []
+    for rank, pieces, metadata in passages.values():
+        pieces.sort()
+        text, end = "", -1
+        for start, piece in pieces:
+            stop = start + len(piece)
+            if text and start < end:
+                if stop <= end:
+                    continue
+                text += piece[end - start:]
+            else:
+                text += ("\n" if text else "") + piece
+            end = max(end, stop)
+        merged.append((rank, Document(page_content=text.strip(), metadata=metadata)))
+    return [doc for _, doc in sorted(merged, key=lambda item: item[0])]
+
+
+def pack_context(ranked_docs, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Turn retrieved chunks (best first) into passages that fit token_budget:
+    near-duplicates are dropped, neighbouring chunks of a page are merged, and
+    passages are cut at sentence boundaries. Returns (passages, estimated tokens).
+    """
+    kept, seen = [], set()
+    for doc in ranked_docs:
+        shingles = _shingles(doc.page_content)
+        if len(shingles & seen) >= DUPLICATE_CONTAINMENT * len(shingles):
+            continue
+        seen |= shingles
+        kept.append(doc)
+
+    packed, used = [], 0
+    for passage in _merge_neighbours(kept):
+        sentences = []
+        for sentence in _whole_sentences(passage.page_content):
+            tokens = estimate_tokens(sentence)
+            if used + tokens > token_budget:
+                break
+            sentences.append(sentence)
+            used += tokens
+        if sentences:
+            packed.append(Document(page_content=" ".join(sentences), metadata=passage.metadata))
+        if used >= token_budget:
+            break
+    return packed, used
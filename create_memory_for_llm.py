@@ -1,89 +1,476 @@
 import os
-from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
+import re
+import json
+import gzip
+import shutil
+import hashlib
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from langchain_core.documents import Document
+from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
 from tqdm import tqdm   # ✅ for progress bar
+from embedding_engine import EmbeddingEngine
+from embedding_cache import CachedEmbeddings
+from memory_store import (
+    build_ann_index, buildable_index_type, flatten_index, index_type_of, load_index_config, load_shard_registry,
+    load_vectorstore, new_vectorstore, pick_search_params, recall_latency_report, remove_vectorstore,
+    save_index_config, save_shard_registry, save_vectorstore, supports_remove, tune_search, vectorstore_exists,
+    INDEX_REPORT_FILE, SHARDS_DIR
+)
 
 # ---------------- CONFIG ----------------
 DATA_PATH = "data/"                     # Folder containing PDFs
 DB_FAISS_PATH = "vectorstore/db_faiss"  # FAISS DB path
+PARSE_WORKERS = os.cpu_count() or 1     # PDF parsing processes (1 = parse serially)
+MANIFEST_PATH = os.path.join(DB_FAISS_PATH, "ingest_manifest.json")  # Per-file record of indexed books
+PAGE_CACHE_PATH = "vectorstore/page_cache"  # Extracted page text per PDF, keyed by file hash
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+INDEX_TYPE = "flat"                     # "flat" (exact), "ivf_flat", "hnsw" or "ivf_pq"
+NPROBE = None                           # IVF lists probed per query (None = pick from recall report)
+EF_SEARCH = None                        # HNSW search breadth (None = pick from recall report)
+RECALL_TARGET = 0.95                    # Recall@5 vs flat that automatic nprobe/efSearch must reach
+EMBED_BATCH_SIZE = 256                  # Chunks embedded and added to the index per step
+EMBED_THREADS = None                    # Torch intra-op threads for embedding (None = torch default)
+EMBED_CONCURRENT_BATCHES = 1            # Batches embedded at the same time
+CHECKPOINT_EVERY_BOOKS = 10             # Save DB + manifest after this many finished books
+SHARDED = False                         # One index per book under DB_FAISS_PATH/shards/ instead of one big index
+DELETE_MISSING_BOOKS = False            # Remove indexed books whose PDF is gone from DATA_PATH (otherwise they are kept)
+MAX_MISSING_RATIO = 0.5                 # Refuse to delete when more than this share of indexed books is missing
 
 # ---------------- Load PDFs ----------------
-def load_new_pdf_files(folder_path=DATA_PATH, existing_books=set()):
-    loader = DirectoryLoader(folder_path, glob="*.pdf", loader_cls=PyPDFLoader)
-    documents = loader.load()
+def page_cache_file(file_hash):
+    return os.path.join(PAGE_CACHE_PATH, f"{file_hash}.json.gz")
 
-    new_documents = []
-    for doc in documents:
-        source_file = os.path.basename(doc.metadata.get("source", "unknown"))
-        book_title = os.path.splitext(source_file)[0]
-
-        # Skip if already in existing FAISS DB
-        if book_title in existing_books:
-            continue
+def parse_pdf_file(file_path, file_hash=None):
+    """
+    Parse one PDF into page Documents tagged with book_title/page metadata.
+    When file_hash is given, pages are read from / written to the page cache so
+    a file is only ever run through PyPDFLoader once.
+    """
+    book_title = os.path.splitext(os.path.basename(file_path))[0]
+    cache_file = page_cache_file(file_hash) if file_hash else None
+    if cache_file and os.path.exists(cache_file):
+        with gzip.open(cache_file, "rt", encoding="utf-8") as f:
+            pages = [Document(page_content=text, metadata=metadata) for text, metadata in json.load(f)]
+    else:
+        pages = PyPDFLoader(file_path).load()
+        if cache_file:
+            os.makedirs(PAGE_CACHE_PATH, exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with gzip.open(tmp_file, "wt", encoding="utf-8") as f:
+                json.dump([[doc.page_content, doc.metadata] for doc in pages], f, separators=(",", ":"))
+            os.replace(tmp_file, cache_file)
 
+    for doc in pages:
+        doc.metadata["source"] = file_path
         doc.metadata["book_title"] = book_title
         if "page" not in doc.metadata:
             doc.metadata["page"] = "N/A"
-        new_documents.append(doc)
+    return pages
+
+def iter_pdf_books(file_paths, workers=PARSE_WORKERS, file_hashes={}):
+    """
+    Yield (file_path, pages) for every file in file_paths, in file order.
+    With workers > 1 the files are parsed in a process pool; only a small window
+    of files is in flight at once so parsed pages never pile up in memory.
+    file_hashes maps paths to content hashes for the page cache.
+    """
+    file_paths = list(file_paths)
+    if workers <= 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            yield file_path, parse_pdf_file(file_path, file_hashes.get(file_path))
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as executor:
+        pending = deque()
+        remaining = iter(file_paths)
+        for file_path in remaining:
+            pending.append((file_path, executor.submit(parse_pdf_file, file_path, file_hashes.get(file_path))))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            file_path, future = pending.popleft()
+            pages = future.result()
+            next_path = next(remaining, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(parse_pdf_file, next_path, file_hashes.get(next_path))))
+            yield file_path, pages
+
+def list_pdf_files(folder_path=DATA_PATH):
+    return sorted(
+        os.path.join(folder_path, name)
+        for name in os.listdir(folder_path)
+        if name.lower().endswith(".pdf")
+    )
+
+# ---------------- Ingestion manifest ----------------
+def file_sha256(file_path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunking_config():
+    return {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+
+# Splitter settings used before they were recorded in the manifest
+LEGACY_CHUNKING = {"chunk_size": 500, "chunk_overlap": 50}
 
-    return new_documents
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    # Write to a temp file first so a crash never leaves a half-written manifest
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def plan_ingestion(file_paths, manifest, existing_books=set()):
+    """
+    Compare PDFs on disk against the manifest without opening them as PDFs.
+    Files whose size and mtime match are skipped without hashing; otherwise the
+    content hash decides. Files indexed with other splitter settings are
+    re-chunked (from the page cache). Books already in a DB built before the
+    manifest existed are adopted as-is. Returns the (path, entry) pairs that
+    need (re-)ingesting.
+    """
+    chunking = chunking_config()
+    to_ingest = []
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        book_title = os.path.splitext(os.path.basename(file_path))[0]
+        known = manifest["files"].get(file_path)
+        same_stat = known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime
+        same_chunking = known and known.get("chunking", LEGACY_CHUNKING) == chunking
+        if same_stat and same_chunking:
+            continue
+
+        entry = {
+            "book_title": book_title,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": known["sha256"] if same_stat else file_sha256(file_path),
+            "chunking": chunking,
+        }
+        already_indexed = (
+            (same_chunking and known["sha256"] == entry["sha256"])
+            or (not known and book_title in existing_books and chunking == LEGACY_CHUNKING)
+        )
+        if already_indexed:
+            # Touched or legacy file, content already indexed: keep chunk_count/shard from the old entry
+            manifest["files"][file_path] = {**(known or {}), **entry}
+            continue
+        to_ingest.append((file_path, entry))
+    return to_ingest
+
+# ---------------- Book-level update / delete ----------------
+def missing_files(manifest, pdf_files, delete=DELETE_MISSING_BOOKS):
+    """
+    Indexed files whose PDF is gone from DATA_PATH and may be removed from the DB.
+    Deletion is explicit (delete / DELETE_MISSING_BOOKS), and refused when
+    DATA_PATH is empty or most indexed books are missing, as with a partly
+    mounted data folder.
+    """
+    missing = [file_path for file_path in manifest["files"] if file_path not in set(pdf_files)]
+    if not missing:
+        return []
+    if not delete:
+        print(f"ℹ️ Keeping {len(missing)} indexed books missing from {DATA_PATH} (set DELETE_MISSING_BOOKS to remove them)")
+        return []
+    if not pdf_files or len(missing) > len(manifest["files"]) * MAX_MISSING_RATIO:
+        print(f"⚠️ {len(missing)} of {len(manifest['files'])} indexed books are missing from {DATA_PATH}; "
+              f"not deleting them (is the folder fully mounted?)")
+        return []
+    return missing
+
+def chunk_ids(entry, count, start=0):
+    """Deterministic docstore ids for a file version, so its chunks can be found again."""
+    prefix = f"{entry['book_title']}:{entry['sha256'][:12]}"
+    return [f"{prefix}:{i}" for i in range(start, count)]
+
+def book_chunk_ids(db, entries):
+    """
+    Return the docstore ids in db that belong to the given manifest entries.
+    Entries without a chunk_count (books indexed before ids were tracked) are
+    found with a single docstore lookup by book_title.
+    """
+    ids = []
+    untracked_titles = set()
+    for entry in entries:
+        if "chunk_count" in entry:
+            ids.extend(chunk_ids(entry, entry["chunk_count"]))
+        else:
+            untracked_titles.add(entry["book_title"])
+    if untracked_titles:
+        ids.extend(db.docstore.ids_for_books(untracked_titles))
+    # A resumed run may already have removed some of them
+    present = db.docstore.existing_ids(ids)
+    return [doc_id for doc_id in ids if doc_id in present]
+
+def delete_books(db, entries):
+    """Remove every chunk of the given books from db by FAISS id; nothing is re-embedded."""
+    ids = book_chunk_ids(db, entries)
+    if ids:
+        if not supports_remove(db.index):
+            # IVF/HNSW cannot drop vectors in place: fall back to flat, the ANN index is rebuilt after ingestion
+            db.index = flatten_index(db.index)
+        db.delete(ids)
+    return len(ids)
 
 # ---------------- Split into chunks ----------------
-def create_chunks(documents):
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=50,
+def make_text_splitter():
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
         length_function=len,
         add_start_index=True
     )
 
-    chunks = []
-    print(f"🔹 Splitting {len(documents)} documents into chunks...")
-    for i, doc in enumerate(tqdm(documents, desc="Chunking progress")):
-        chunks.extend(text_splitter.split_documents([doc]))
-    print(f"✅ Total chunks created: {len(chunks)}")
-    return chunks
+def iter_chunks(documents, text_splitter=None):
+    text_splitter = text_splitter or make_text_splitter()
+    for doc in documents:
+        yield from text_splitter.split_documents([doc])
 
-# ---------------- Load or create FAISS DB ----------------
-embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
-if os.path.exists(DB_FAISS_PATH):
-    print("📂 Existing FAISS DB found, loading...")
-    db = FAISS.load_local(DB_FAISS_PATH, embedding_model, allow_dangerous_deserialization=True)
+# ---------------- Embed and index ----------------
+def add_chunks_to_db(db, chunks, engine, entry, batch_size=EMBED_BATCH_SIZE, path=DB_FAISS_PATH):
+    """
+    Embed chunks batch by batch and append them straight into db, so only a few
+    batches of texts and vectors are held at a time. Creates the DB at path from
+    the first batch when db is None. Chunks get the deterministic ids of entry.
+    Returns (db, number of chunks added).
+    """
+    added = 0
+    for batch, vectors in engine.embed_batches(batched(chunks, batch_size)):
+        texts = [chunk.page_content for chunk in batch]
+        metadatas = [chunk.metadata for chunk in batch]
+        ids = chunk_ids(entry, added + len(batch), start=added)
+        if db is None:
+            db = new_vectorstore(path, engine.embedding_model, len(vectors[0]))
+        db.add_embeddings(zip(texts, vectors), metadatas=metadatas, ids=ids)
+        added += len(batch)
+    return db, added
 
-    # Get existing book titles from the DB
-    existing_books = set(doc.metadata.get("book_title") for doc_id, doc in db.docstore._dict.items())
-    print(f"📚 Already in DB: {existing_books}")
+def save_checkpoint(db, manifest):
+    # The index is written before the manifest, and only at book boundaries, so
+    # every book listed in a saved manifest is fully present in the saved index
+    save_vectorstore(db, DB_FAISS_PATH)
+    save_manifest(manifest)
 
-    # Load only new books
-    new_docs = load_new_pdf_files(DATA_PATH, existing_books)
-    if new_docs:
-        print(f"📄 Loaded {len(new_docs)} new PDF pages")
+# ---------------- Build ANN index ----------------
+def print_index_report(report):
+    print("📊 Recall@5 vs flat baseline:")
+    for row in report:
+        setting = f"{row['param']}={row['value']}" if row["param"] else "exact"
+        print(f"   {row['index']:<9} {setting:<14} recall={row['recall']:.3f}  "
+              f"mean={row['mean_ms']:.3f}ms  p95={row['p95_ms']:.3f}ms")
 
-        # Split into chunks
-        new_chunks = create_chunks(new_docs)
+def convert_index(db, index_type, path=DB_FAISS_PATH, verbose=True):
+    """
+    Rebuild db.index as index_type from its current vectors (no re-embedding) and
+    return the index config to save, including automatically tuned search params.
+    """
+    current_type = index_type_of(db.index)
+    flat = db.index if current_type == "flat" else flatten_index(db.index)
+    if index_type == "flat":
+        db.index = flat
+        return {"index_type": "flat"}
+
+    if verbose:
+        print(f"🧭 Building {index_type} index over {flat.ntotal} vectors...")
+    db.index = build_ann_index(flat, index_type)
+    report = recall_latency_report(flat, db.index)
+    if verbose:
+        print_index_report(report)
+    with open(os.path.join(path, INDEX_REPORT_FILE), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return {"index_type": index_type_of(db.index), **pick_search_params(report, RECALL_TARGET)}
+
+def finalize_index(db, path=DB_FAISS_PATH, verbose=True):
+    """Convert db to INDEX_TYPE if needed, apply search params and return the config to save."""
+    index_config = load_index_config(path)
+    # An ivf_pq target over too few vectors for PQ is met by ivf_flat until the DB grows
+    if index_type_of(db.index) != buildable_index_type(INDEX_TYPE, db.index.ntotal):
+        os.makedirs(path, exist_ok=True)
+        index_config = convert_index(db, INDEX_TYPE, path, verbose)
+    if NPROBE:
+        index_config["nprobe"] = NPROBE
+    if EF_SEARCH:
+        index_config["ef_search"] = EF_SEARCH
+    tune_search(db.index, nprobe=index_config.get("nprobe"), ef_search=index_config.get("ef_search"))
+    return index_config
+
+def print_ingestion_stats(total_chunks, engine):
+    print(f"✅ Added {total_chunks} new chunks to FAISS DB")
+    print(f"⚙️ Embedding throughput: {engine.report()}")
+    print(f"🗃️ Embedding cache: {engine.embedding_model.hits} hits, {engine.embedding_model.misses} newly embedded")
+
+# ---------------- Single-index layout ----------------
+def ingest_single(manifest, engine):
+    db = None
+    existing_books = set()
+    if vectorstore_exists(DB_FAISS_PATH):
+        print("📂 Existing FAISS DB found, loading...")
+        db = load_vectorstore(DB_FAISS_PATH, engine.embedding_model, writable=True)
+
+        # Get existing book titles from the DB
+        existing_books = db.docstore.book_titles()
+        print(f"📚 Already in DB: {existing_books}")
+    else:
+        print("🆕 No FAISS DB found, creating new DB from all PDFs...")
+        manifest["files"] = {}
+
+    # Only new, changed or re-chunked files are ingested; a crashed run resumes from its
+    # last checkpoint. Previously parsed files are read from the page cache, not the PDF.
+    pdf_files = list_pdf_files(DATA_PATH)
+    removed_files = missing_files(manifest, pdf_files)
+    to_ingest = dict(plan_ingestion(pdf_files, manifest, existing_books))
+
+    # Books whose PDF was deleted or replaced lose their old chunks up front
+    if db is not None:
+        stale_entries = [manifest["files"][file_path] for file_path in removed_files]
+        for file_path, entry in to_ingest.items():
+            if file_path in manifest["files"]:
+                stale_entries.append(manifest["files"][file_path])
+            elif entry["book_title"] in existing_books:
+                stale_entries.append({"book_title": entry["book_title"]})
+        removed = delete_books(db, stale_entries)
+        if removed:
+            print(f"♻️ Removed {removed} chunks of {len(stale_entries)} deleted or changed books")
+    for file_path in removed_files:
+        del manifest["files"][file_path]
+
+    if to_ingest:
+        print(f"📄 Ingesting {len(to_ingest)} new or changed PDF files...")
+        text_splitter = make_text_splitter()
+        total_chunks = 0
+        books = tqdm(
+            iter_pdf_books(list(to_ingest), file_hashes={path: entry["sha256"] for path, entry in to_ingest.items()}),
+            total=len(to_ingest), desc="Ingestion progress")
+        for books_done, (file_path, pages) in enumerate(books, start=1):
+            entry = to_ingest[file_path]
+            db, added = add_chunks_to_db(db, iter_chunks(pages, text_splitter), engine, entry)
+            total_chunks += added
+            chunks_per_sec, tokens_per_sec = engine.throughput()
+            books.set_postfix(chunks=total_chunks, chunks_s=f"{chunks_per_sec:.0f}", tokens_s=f"{tokens_per_sec:.0f}")
+
+            entry["chunk_count"] = added
+            manifest["files"][file_path] = entry
+            if db is not None and books_done % CHECKPOINT_EVERY_BOOKS == 0:
+                save_checkpoint(db, manifest)
+        print_ingestion_stats(total_chunks, engine)
+    else:
+        print("✅ No new or changed books to add")
+
+    # ---------------- Save DB ----------------
+    if db is not None:
+        index_config = finalize_index(db)
+        save_checkpoint(db, manifest)
+        save_index_config(DB_FAISS_PATH, index_config)
+        print(f"✅ FAISS DB ({index_config['index_type']}) saved at {DB_FAISS_PATH}")
+
+# ---------------- Sharded layout ----------------
+def shard_name(entry):
+    """Directory name of a book version's shard; changes whenever its content or chunking does."""
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", entry["book_title"]).strip("-").lower()[:60]
+    chunking = entry["chunking"]
+    return f"{slug}-{entry['sha256'][:12]}-{chunking['chunk_size']}-{chunking['chunk_overlap']}"
+
+def ingest_sharded(manifest, engine):
+    """
+    Give every book its own DB under DB_FAISS_PATH/shards/. New books only write
+    new shards; a changed book gets a fresh shard and its old one is dropped,
+    and nothing else is touched. Manifest and registry are saved after every
+    book, before any old shard is deleted.
+    """
+    shards_path = os.path.join(DB_FAISS_PATH, SHARDS_DIR)
+    registry = load_shard_registry(DB_FAISS_PATH)
+    pdf_files = list_pdf_files(DATA_PATH)
+    removed_files = missing_files(manifest, pdf_files)
+    to_ingest = dict(plan_ingestion(pdf_files, manifest))
+
+    def drop_shards(entries):
+        names = [entry["shard"] for entry in entries if entry and entry.get("shard") in registry]
+        for name in names:
+            del registry[name]
+        save_manifest(manifest)
+        save_shard_registry(DB_FAISS_PATH, registry)
+        for name in names:
+            shutil.rmtree(os.path.join(shards_path, name), ignore_errors=True)
+
+    if removed_files:
+        drop_shards([manifest["files"].pop(file_path) for file_path in removed_files])
+        print(f"♻️ Removed shards of {len(removed_files)} deleted books")
+
+    if not to_ingest:
+        save_manifest(manifest)
+        save_shard_registry(DB_FAISS_PATH, registry)
+        print(f"✅ No new or changed books to add ({len(registry)} shards)")
+        return
+
+    print(f"📄 Ingesting {len(to_ingest)} new or changed PDF files into shards...")
+    text_splitter = make_text_splitter()
+    total_chunks = 0
+    books = tqdm(
+        iter_pdf_books(list(to_ingest), file_hashes={path: entry["sha256"] for path, entry in to_ingest.items()}),
+        total=len(to_ingest), desc="Ingestion progress")
+    for file_path, pages in books:
+        entry = to_ingest[file_path]
+        name = shard_name(entry)
+        shard_path = os.path.join(shards_path, name)
+        shard, added = add_chunks_to_db(None, iter_chunks(pages, text_splitter), engine, entry, path=shard_path)
+        total_chunks += added
+        chunks_per_sec, tokens_per_sec = engine.throughput()
+        books.set_postfix(chunks=total_chunks, chunks_s=f"{chunks_per_sec:.0f}", tokens_s=f"{tokens_per_sec:.0f}")
+
+        if shard is not None:
+            index_config = finalize_index(shard, shard_path, verbose=False)
+            save_vectorstore(shard, shard_path)
+            save_index_config(shard_path, index_config)
+            registry[name] = entry["book_title"]
+            entry["shard"] = name
+
+        entry["chunk_count"] = added
+        old_entry = manifest["files"].get(file_path)
+        manifest["files"][file_path] = entry
+        drop_shards([old_entry] if old_entry and old_entry.get("shard") != name else [])
+    print_ingestion_stats(total_chunks, engine)
+    print(f"✅ {len(registry)} shards saved under {shards_path}")
+
+# ---------------- Load or create FAISS DB ----------------
+# Kept under a main guard so PDF parsing workers can import this module safely
+if __name__ == "__main__":
+    # Only chunks missing from the on-disk embedding cache reach the model
+    embedding_model = CachedEmbeddings(HuggingFaceEmbeddings(
+        model_name="sentence-transformers/all-MiniLM-L6-v2",
+        encode_kwargs={"batch_size": EMBED_BATCH_SIZE}
+    ))
+    engine = EmbeddingEngine(embedding_model, threads=EMBED_THREADS, concurrent_batches=EMBED_CONCURRENT_BATCHES)
 
-        # Embedding with progress bar
-        print("⚙️ Generating embeddings for new chunks...")
-        db_new = FAISS.from_documents(tqdm(new_chunks, desc="Embedding progress"), embedding_model)
+    manifest = load_manifest()
+    layout = "sharded" if SHARDED else "single"
+    if manifest.get("layout", "single") != layout:
+        # Cheap thanks to the page and embedding caches: nothing is re-parsed or re-embedded
+        print(f"🔀 DB layout changed to {layout}, rebuilding it from the page and embedding caches...")
+        remove_vectorstore(DB_FAISS_PATH)
+        manifest = {"files": {}}
+    manifest["layout"] = layout
 
-        db.merge_from(db_new)
-        print(f"✅ Merged {len(new_chunks)} new chunks into FAISS DB")
+    if SHARDED:
+        ingest_sharded(manifest, engine)
     else:
-        print("✅ No new books to add")
-else:
-    print("🆕 No FAISS DB found, creating new DB from all PDFs...")
-    all_docs = load_new_pdf_files(DATA_PATH)
-    chunks = create_chunks(all_docs)
-
-    # Embedding with progress bar
-    print("⚙️ Generating embeddings for all chunks...")
-    db = FAISS.from_documents(tqdm(chunks, desc="Embedding progress"), embedding_model)
-    print(f"✅ Created new FAISS DB with {len(chunks)} chunks")
-
-# ---------------- Save DB ----------------
-os.makedirs(DB_FAISS_PATH, exist_ok=True)
-db.save_local(DB_FAISS_PATH)
-print(f"✅ FAISS DB saved at {DB_FAISS_PATH}")
+        ingest_single(manifest, engine)
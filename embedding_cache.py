@@ -0,0 +1,210 @@
+# embedding_cache.py
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_PATH = "vectorstore/embedding_cache.sqlite"
+EMBEDDING_CACHE_MAX_BYTES = 2 * 1024 ** 3   # Evict least recently used vectors above this size
+QUERY_LRU_SIZE = 10000                      # Query embeddings kept in memory per process
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).digest()
+
+
+def normalize_query(text: str) -> str:
+    # Query cache key for uncased models (e.g. MiniLM), where case never changes
+    # the vector and surrounding punctuation ("...diabetes?" vs "...diabetes") barely does
+    return normalize_text(text).lower().strip(" ?!.,;:")
+
+
+class QueryEmbeddingLRU:
+    """Thread-safe in-memory LRU of normalized query -> embedding, with hit/miss counters."""
+
+    def __init__(self, maxsize=QUERY_LRU_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key, vector):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries), "hits": self.hits, "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Shared by every CachedEmbeddings in the process, i.e. by all Streamlit sessions
+QUERY_EMBEDDING_LRU = QueryEmbeddingLRU()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed float32 vector cache in SQLite, keyed by
+    (model name, sha256 of the whitespace-normalized text).
+    Least recently used rows are evicted once the stored vectors exceed max_bytes.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            " model TEXT NOT NULL, key BLOB NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL,"
+            " UNIQUE (model, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS vectors_last_used ON vectors (last_used)")
+        self._conn.commit()
+        self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM vectors").fetchone()[0]
+
+    def get_many(self, model, keys):
+        """Return {key: vector} for the keys that are cached, refreshing their LRU timestamp."""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM vectors WHERE model = ? AND key IN ({','.join('?' * len(part))})",
+                    [model, *part]
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE vectors SET last_used = ? WHERE model = ? AND key = ?",
+                    [(now, model, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model, items):
+        """Store (key, vector) pairs and evict old entries if the cache grew past max_bytes."""
+        now = time.time()
+        rows = [(model, key, array("f", vector).tobytes(), now) for key, vector in items]
+        with self._lock:
+            for _, key, _, _ in rows:
+                old = self._conn.execute(
+                    "SELECT LENGTH(vector) FROM vectors WHERE model = ? AND key = ?", (model, key)
+                ).fetchone()
+                if old:
+                    self.total_bytes -= old[0]
+            self._conn.executemany("INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?)", rows)
+            self.total_bytes += sum(len(row[2]) for row in rows)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Drop the oldest rows until the cache is back under 90% of its budget
+        count, size = self._conn.execute("SELECT COUNT(*), SUM(LENGTH(vector)) FROM vectors").fetchone()
+        if not count:
+            return
+        excess = size - int(self.max_bytes * 0.9)
+        n_rows = min(count, -(-excess // (size // count)))
+        self._conn.execute(
+            "DELETE FROM vectors WHERE rowid IN (SELECT rowid FROM vectors ORDER BY last_used LIMIT ?)", (n_rows,)
+        )
+        self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM vectors").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    LangChain Embeddings wrapper that only sends texts missing from the cache
+    to base_embeddings. Query and document vectors are cached separately since
+    models may encode them differently; queries first go through an in-memory
+    LRU so repeated questions skip both SQLite and the encoder. query_key maps a
+    query to its cache key (pass normalize_query for uncased models); the
+    encoder always sees the original query text.
+    """
+
+    def __init__(self, base_embeddings, cache=None, model_name=None, query_lru=QUERY_EMBEDDING_LRU,
+                 query_key=normalize_text):
+        self.base_embeddings = base_embeddings
+        self.query_key = query_key
+        self.cache = cache or EmbeddingCache()
+        self.query_lru = query_lru
+        self.model_name = model_name or getattr(base_embeddings, "model_name", type(base_embeddings).__name__)
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        return self.embed_documents_with_misses(texts)[0]
+
+    def embed_documents_with_misses(self, texts):
+        """Like embed_documents, but also return the distinct texts that were sent to the encoder."""
+        keys = [text_key(text) for text in texts]
+        cached = self.cache.get_many(self.model_name, list(set(keys)))
+
+        # Embed each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.base_embeddings.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, new_items)
+            cached.update(new_items)
+
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [cached[key] for key in keys], list(missing.values())
+
+    def embed_query(self, text):
+        model = self.model_name + "#query"
+        lru_key = (model, self.query_key(text))
+        vector = self.query_lru.get(lru_key)
+        if vector is not None:
+            self.hits += 1
+            return vector
+
+        key = text_key(lru_key[1])
+        cached = self.cache.get_many(model, [key])
+        if key in cached:
+            self.hits += 1
+            vector = cached[key]
+        else:
+            self.misses += 1
+            vector = self.base_embeddings.embed_query(text)
+            self.cache.put_many(model, [(key, vector)])
+        self.query_lru.put(lru_key, vector)
+        return vector
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
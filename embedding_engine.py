@@ -0,0 +1,95 @@
+# embedding_engine.py
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class EmbeddingEngine:
+    """
+    Embed batches of chunk Documents through a LangChain embedding model.
+    Vectors come from embedding_model.embed_documents, so they are identical to
+    FAISS.from_documents with the same model; this class only controls how the
+    work is scheduled and measures real throughput.
+    """
+
+    def __init__(self, embedding_model, threads=None, concurrent_batches=1):
+        self.embedding_model = embedding_model
+        self.concurrent_batches = max(1, concurrent_batches)
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+
+        # sentence-transformers model behind HuggingFaceEmbeddings (possibly cache-wrapped), used only for token counts
+        base = getattr(embedding_model, "base_embeddings", embedding_model)
+        client = getattr(base, "_client", None) or getattr(base, "client", None)
+        self.tokenizer = getattr(client, "tokenizer", None)
+        self.max_seq_length = getattr(client, "max_seq_length", None)
+
+        self.chunks = 0
+        self.tokens = 0
+        self.seconds = 0.0
+
+    def count_tokens(self, texts):
+        if self.tokenizer is None:
+            return 0
+        encoded = self.tokenizer(texts, truncation=bool(self.max_seq_length), max_length=self.max_seq_length)
+        return sum(len(ids) for ids in encoded["input_ids"])
+
+    def _embed(self, batch):
+        # Only texts that reached the encoder count as embedded tokens, not cache hits
+        texts = [doc.page_content for doc in batch]
+        if hasattr(self.embedding_model, "embed_documents_with_misses"):
+            vectors, encoded = self.embedding_model.embed_documents_with_misses(texts)
+            return vectors, self.count_tokens(encoded) if encoded else 0
+        return self.embedding_model.embed_documents(texts), self.count_tokens(texts)
+
+    def embed_batches(self, batches):
+        """
+        Yield (batch, vectors) for every batch of Documents, in input order.
+        Up to concurrent_batches batches are embedded at once on a thread pool.
+        Time spent by the caller between yields is not counted as embedding time.
+        """
+        started = time.perf_counter()
+        if self.concurrent_batches == 1:
+            for batch in batches:
+                vectors, tokens = self._embed(batch)
+                started = self._record(batch, tokens, started)
+                yield batch, vectors
+                started = time.perf_counter()
+            return
+
+        with ThreadPoolExecutor(max_workers=self.concurrent_batches) as executor:
+            pending = deque()
+            for batch in batches:
+                pending.append((batch, executor.submit(self._embed, batch)))
+                if len(pending) < self.concurrent_batches:
+                    continue
+                done_batch, future = pending.popleft()
+                vectors, tokens = future.result()
+                started = self._record(done_batch, tokens, started)
+                yield done_batch, vectors
+                started = time.perf_counter()
+            while pending:
+                done_batch, future = pending.popleft()
+                vectors, tokens = future.result()
+                started = self._record(done_batch, tokens, started)
+                yield done_batch, vectors
+                started = time.perf_counter()
+
+    def _record(self, batch, tokens, started):
+        now = time.perf_counter()
+        self.seconds += now - started
+        self.chunks += len(batch)
+        self.tokens += tokens
+        return now
+
+    def throughput(self):
+        seconds = self.seconds or float("inf")
+        return self.chunks / seconds, self.tokens / seconds
+
+    def report(self):
+        chunks_per_sec, tokens_per_sec = self.throughput()
+        return (
+            f"{self.chunks} chunks / {self.tokens} tokens embedded in {self.seconds:.1f}s "
+            f"({chunks_per_sec:.1f} chunks/s, {tokens_per_sec:.0f} tokens/s)"
+        )
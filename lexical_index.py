@@ -0,0 +1,147 @@
+# lexical_index.py
+import re
+import math
+import heapq
+from collections import Counter
+from itertools import islice
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+POSTINGS_PER_TERM = 1000    # Highest-impact postings read per query term
+ADD_BATCH_SIZE = 1000       # Chunks tokenized and written per batch
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")   # keeps "hba1c", "7.5", "beta-blocker"
+STOPWORDS = frozenset(
+    "a an and are as at be been by can do does for from had has have how i in is it its of on or "
+    "should that the their there these this to was were what when which who why will with you your".split()
+)
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index stored in the chunk store's SQLite file, next to the
+    chunks it indexes, so it is written, committed and deleted together with
+    them. Documents are the chunk table's rowids.
+
+    Each posting stores its BM25 term-frequency component ("impact", length
+    normalized with the average chunk length when it was indexed), clustered
+    by term id and impact, so a query reads only the best postings per term.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn   # Callable returning the (thread-local) SQLite connection
+
+    @staticmethod
+    def create_tables(conn):
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(lexical_postings)")]
+        if "term" in columns:
+            # Text-keyed postings without impacts: drop them, the chunk store backfills the index
+            for table in ("lexical_postings", "lexical_terms", "lexical_docs"):
+                conn.execute(f"DROP TABLE {table}")
+            conn.execute("DELETE FROM meta WHERE key IN ('bm25_docs', 'bm25_length')")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS lexical_terms ("
+            " id INTEGER PRIMARY KEY, term TEXT NOT NULL UNIQUE, df INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS lexical_postings ("
+            " term_id INTEGER NOT NULL, impact REAL NOT NULL, doc INTEGER NOT NULL,"
+            " PRIMARY KEY (term_id, impact DESC, doc)) WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS lexical_postings_doc ON lexical_postings (doc)")
+        conn.execute("CREATE TABLE IF NOT EXISTS lexical_docs (doc INTEGER PRIMARY KEY, length INTEGER NOT NULL)")
+
+    def _stats(self):
+        conn = self._conn()
+        n_docs = conn.execute("SELECT value FROM meta WHERE key = 'bm25_docs'").fetchone()
+        total_length = conn.execute("SELECT value FROM meta WHERE key = 'bm25_length'").fetchone()
+        return (n_docs[0] if n_docs else 0), (total_length[0] if total_length else 0)
+
+    def _set_stats(self, n_docs, total_length):
+        self._conn().executemany(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?)", [("bm25_docs", n_docs), ("bm25_length", total_length)]
+        )
+
+    def _term_ids(self, terms):
+        conn = self._conn()
+        term_ids = {}
+        for start in range(0, len(terms), 500):
+            part = terms[start:start + 500]
+            placeholders = ','.join('?' * len(part))
+            term_ids.update(conn.execute(f"SELECT term, id FROM lexical_terms WHERE term IN ({placeholders})", part))
+        return term_ids
+
+    def add(self, docs_and_texts):
+        """Index (rowid, text) pairs."""
+        docs_and_texts = iter(docs_and_texts)
+        while True:
+            batch = [(doc, Counter(tokenize(text))) for doc, text in islice(docs_and_texts, ADD_BATCH_SIZE)]
+            if not batch:
+                break
+            self._add_batch(batch)
+
+    def _add_batch(self, batch):
+        conn = self._conn()
+        n_docs, total_length = self._stats()
+        lengths = [sum(counts.values()) for _, counts in batch]
+        n_docs += len(batch)
+        total_length += sum(lengths)
+        avg_length = total_length / n_docs
+
+        doc_freqs = Counter(term for _, counts in batch for term in counts)
+        conn.executemany(
+            "INSERT INTO lexical_terms (term, df) VALUES (?, ?) ON CONFLICT (term) DO UPDATE SET df = df + excluded.df",
+            doc_freqs.items()
+        )
+        term_ids = self._term_ids(list(doc_freqs))
+        for (doc, counts), length in zip(batch, lengths):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+            conn.executemany(
+                "INSERT INTO lexical_postings VALUES (?, ?, ?)",
+                [(term_ids[term], tf * (BM25_K1 + 1) / (tf + norm), doc) for term, tf in counts.items()]
+            )
+            conn.execute("INSERT OR REPLACE INTO lexical_docs VALUES (?, ?)", (doc, length))
+        self._set_stats(n_docs, total_length)
+
+    def delete(self, docs):
+        conn = self._conn()
+        n_docs, total_length = self._stats()
+        for doc in docs:
+            row = conn.execute("SELECT length FROM lexical_docs WHERE doc = ?", (doc,)).fetchone()
+            if row is None:
+                continue
+            term_ids = conn.execute("SELECT term_id FROM lexical_postings WHERE doc = ?", (doc,)).fetchall()
+            conn.executemany("UPDATE lexical_terms SET df = df - 1 WHERE id = ?", term_ids)
+            conn.execute("DELETE FROM lexical_postings WHERE doc = ?", (doc,))
+            conn.execute("DELETE FROM lexical_docs WHERE doc = ?", (doc,))
+            n_docs -= 1
+            total_length -= row[0]
+        conn.execute("DELETE FROM lexical_terms WHERE df <= 0")
+        self._set_stats(n_docs, total_length)
+
+    def search(self, query, k):
+        """Return up to k (rowid, BM25 score) pairs, best first."""
+        conn = self._conn()
+        n_docs, _ = self._stats()
+        if not n_docs:
+            return []
+
+        scores = Counter()
+        for term in set(tokenize(query)):
+            row = conn.execute("SELECT id, df FROM lexical_terms WHERE term = ?", (term,)).fetchone()
+            # Common terms are down-weighted by idf, not skipped: a book's own subject is in most of its chunks
+            if row is None:
+                continue
+            term_id, df = row
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            # Highest-impact postings first; the LIMIT bounds the work for common terms
+            postings = conn.execute(
+                "SELECT doc, impact FROM lexical_postings WHERE term_id = ? ORDER BY impact DESC LIMIT ?",
+                (term_id, max(POSTINGS_PER_TERM, k))
+            )
+            for doc, impact in postings:
+                scores[doc] += idf * impact
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
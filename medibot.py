@@ -1,20 +1,26 @@
 import streamlit as st
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from groq import Groq
 import os
 from datetime import datetime
 from dotenv import load_dotenv
-import base64
-import tempfile
+import time
+import asyncio
+import threading
 from audio_recorder_streamlit import audio_recorder
 from PIL import Image
-import io
 
 # Import custom modules
-from voice_of_the_patient import transcribe_with_groq
-from voice_of_the_doctor import text_to_speech_with_elevenlabs, text_to_speech_with_gtts
-from brain_of_the_doctor import encode_image, analyze_image_with_query
+from voice_of_the_patient import transcribe_bytes_with_groq
+from voice_of_the_doctor import text_to_speech_bytes_with_elevenlabs, text_to_speech_bytes_with_gtts
+from brain_of_the_doctor import prepare_image, analyze_image_with_query
+from embedding_cache import CachedEmbeddings, QUERY_EMBEDDING_LRU, normalize_query
+from answer_cache import SemanticAnswerCache
+from reranker import CrossEncoderReranker
+from context_packer import pack_context
+from answer_stream import stream_completion
+from speech_pipeline import OrderedPlayback, SentenceSpeechPipeline, concat_audio
+from tts_cache import TTS_CACHE
+import memory_store
 
 # ====================== PAGE CONFIG ======================
 st.set_page_config(
@@ -50,40 +56,98 @@ if "record_voice" not in st.session_state:
     st.session_state.record_voice = False
 if "upload_image" not in st.session_state:
     st.session_state.upload_image = False
+if "prompt_tokens" not in st.session_state:
+    st.session_state.prompt_tokens = None
 
 # ====================== CONFIG ======================
 DB_FAISS_PATH = "vectorstore/db_faiss"
 TOP_K = 5
+HYBRID_FETCH_K = 20             # Candidates taken from each of the dense and BM25 lists before fusion
+MMR_LAMBDA = 0.7                # Relevance vs diversity of dense hits (1.0 = plain nearest neighbours)
 MAX_OUTPUT_TOKENS = 600
 TEMPERATURE = 0.3
-
-# ====================== INIT GROQ CLIENT ======================
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-groq_client = Groq(api_key=GROQ_API_KEY)
+ANSWER_CACHE_THRESHOLD = 0.95   # Cosine similarity a repeated question needs to reuse an answer
+ANSWER_CACHE_TTL = 3600         # Seconds a cached answer stays valid
+ANSWER_CACHE_SIZE = 1000        # Cached answers kept per process
+RERANK_ENABLED = True           # Re-score fused candidates with a local cross-encoder
+RERANK_FETCH_K = 20             # Candidates handed to the reranker
+RERANK_TOP_K = 3                # Chunks sent to the LLM after reranking
+RERANK_BUDGET_MS = 200          # Past this the candidates keep their retrieval order
+CONTEXT_TOKEN_BUDGET = 1200     # Tokens of retrieved literature packed into the prompt
+AUDIO_FORMAT = "mp3"            # Provider's compressed audio as delivered; "wav" only for clients that need it
+AUDIO_MIME_TYPES = {"mp3": "audio/mpeg", "wav": "audio/wav"}
+DB_UNAVAILABLE_MESSAGE = "Sorry, the medical database is currently unavailable. Please try again later."
+NO_RESULTS_MESSAGE = "I couldn't find specific information about your query in my medical database. Please consult with a healthcare professional for personalized advice."
+TECHNICAL_ERROR_MESSAGE = "I'm experiencing technical difficulties. Please try again in a moment."
+
+# ====================== GROQ API KEY ======================
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")   # Provider calls go through the pooled clients in provider_gateway
 
 # ====================== LOAD FAISS ======================
-@st.cache_resource
-def load_vectorstore():
+@st.cache_resource(max_entries=1)
+def load_vectorstore(generation):
+    # Keyed on the index generation: a rebuilt DB is reloaded whole, never a
+    # stale memory-mapped index read through the new position map
     try:
-        embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        return FAISS.load_local(DB_FAISS_PATH, embedding_model, allow_dangerous_deserialization=True)
+        embedding_model = CachedEmbeddings(
+            HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2"), query_key=normalize_query
+        )
+        return memory_store.load_vectorstore(DB_FAISS_PATH, embedding_model)
     except Exception as e:
         return None
 
-db = load_vectorstore()
+db_generation = memory_store.index_generation(DB_FAISS_PATH)
+db = load_vectorstore(db_generation)
+
+@st.cache_resource
+def load_answer_cache():
+    # Shared by all sessions in this process
+    return SemanticAnswerCache(ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_SIZE)
+
+answer_cache = load_answer_cache()
+
+@st.cache_resource
+def load_reranker():
+    return CrossEncoderReranker(budget_ms=RERANK_BUDGET_MS) if RERANK_ENABLED else None
+
+reranker = load_reranker()
 
 # ====================== HELPER FUNCTIONS ======================
-def generate_answer(question: str):
-    """Generate text answer from RAG pipeline"""
+def retrieve_documents(question: str):
+    """Embed the question and return (query vector, best chunks) from hybrid retrieval + rerank"""
+    query_vector = db.embedding_function.embed_query(question)
+    candidates = memory_store.hybrid_search(
+        db, question, query_vector, k=RERANK_FETCH_K if reranker else TOP_K,
+        fetch_k=HYBRID_FETCH_K, mmr_lambda=MMR_LAMBDA
+    )
+    if reranker:
+        candidates = reranker.rerank(question, candidates, k=RERANK_TOP_K)
+    return query_vector, [doc for doc, _ in candidates]
+
+
+def generate_answer(question: str, on_text=None, retrieved=None, image_findings=None):
+    """
+    Generate text answer from RAG pipeline, passing the text so far to on_text while it streams.
+    retrieved is a (query vector, docs) pair that was already fetched; image_findings is the
+    vision model's description of an attached image, to be grounded in the literature.
+    """
     if not db:
-        return "Sorry, the medical database is currently unavailable. Please try again later."
+        return DB_UNAVAILABLE_MESSAGE
     
     try:
-        docs = db.similarity_search(question, k=TOP_K)
-        if not docs:
-            return "I couldn't find specific information about your query in my medical database. Please consult with a healthcare professional for personalized advice."
+        query_vector, docs = retrieved or retrieve_documents(question)
+        if not docs and not image_findings:
+            return NO_RESULTS_MESSAGE
+
+        # Near-duplicate question over the same chunks: reuse the stored answer (never for images)
+        cached_answer = None if image_findings else answer_cache.lookup(query_vector, docs, db_generation)
+        if cached_answer:
+            if on_text:
+                on_text(cached_answer)
+            return cached_answer
         
-        context_text = "\n\n".join([doc.page_content[:800] for doc in docs])
+        packed_docs, _ = pack_context(docs, CONTEXT_TOKEN_BUDGET)
+        context_text = "\n\n".join([doc.page_content for doc in packed_docs])
         
         system_message = {
             "role": "system",
@@ -91,25 +155,35 @@ def generate_answer(question: str):
                 "You are Medibot, a professional medical assistant AI. "
                 "Provide accurate, helpful medical information based only on the provided medical literature. "
                 "Be empathetic, clear, and concise. If you cannot answer from the provided context, say so clearly."
+                + (" When image findings are given, explain them in light of the literature." if image_findings else "")
             )
         }
         
+        findings_text = f"Image Findings:\n{image_findings}\n\n" if image_findings else ""
         user_message = {
             "role": "user",
-            "content": f"Question: {question}\n\nMedical Literature Context:\n{context_text}"
+            "content": f"Question: {question}\n\n{findings_text}Medical Literature Context:\n{context_text}"
         }
         
-        response = groq_client.chat.completions.create(
+        started = time.perf_counter()
+        answer, usage = stream_completion(
+            on_text or (lambda text: None),
+            api_key=GROQ_API_KEY,
             model="llama-3.3-70b-versatile",
             messages=[system_message, user_message],
             temperature=TEMPERATURE,
             max_completion_tokens=MAX_OUTPUT_TOKENS
         )
         
-        return response.choices[0].message.content.strip()
+        if usage:
+            st.session_state.prompt_tokens = usage.prompt_tokens
+        answer = answer.strip()
+        if not image_findings:
+            answer_cache.store(query_vector, docs, answer, time.perf_counter() - started, db_generation)
+        return answer
     
     except Exception as e:
-        return "I'm experiencing technical difficulties. Please try again in a moment."
+        return TECHNICAL_ERROR_MESSAGE
 
 
 def process_audio_input(audio_bytes):
@@ -118,58 +192,63 @@ def process_audio_input(audio_bytes):
         if len(audio_bytes) < 1000:
             return None
             
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_audio:
-            tmp_audio.write(audio_bytes)
-            tmp_audio_path = tmp_audio.name
-        
-        transcription = transcribe_with_groq(GROQ_API_KEY, tmp_audio_path)
-        os.unlink(tmp_audio_path)
-        
-        return transcription
+        return transcribe_bytes_with_groq(GROQ_API_KEY, audio_bytes, "audio.wav")
     except Exception as e:
         st.error(f"Error processing audio: {str(e)}")
         return None
 
 
-def generate_voice_response(text: str):
-    """Generate voice output from text"""
+def synthesize_speech(text: str):
+    """Text to AUDIO_FORMAT bytes, ElevenLabs first with gTTS as fallback (safe to call from worker threads)"""
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_audio:
-            tmp_audio_path = tmp_audio.name
-        
-        try:
-            text_to_speech_with_elevenlabs(text, tmp_audio_path)
-        except:
-            text_to_speech_with_gtts(text, tmp_audio_path)
-        
-        with open(tmp_audio_path, "rb") as audio_file:
-            audio_bytes = audio_file.read()
-        
-        os.unlink(tmp_audio_path)
-        
-        return audio_bytes
-    except Exception as e:
-        st.error(f"Error generating voice: {str(e)}")
-        return None
+        return text_to_speech_bytes_with_elevenlabs(text, audio_format=AUDIO_FORMAT)
+    except:
+        return text_to_speech_bytes_with_gtts(text, audio_format=AUDIO_FORMAT)
 
 
-def process_image_with_text(image, text_query):
-    """Process image with text query"""
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_img:
-            image.save(tmp_img.name, format="JPEG")
-            tmp_img_path = tmp_img.name
-        
-        encoded_image = encode_image(tmp_img_path)
-        medical_context = f"{text_query}\n\nProvide medical insights about this image. Be specific and educational."
-        analysis = analyze_image_with_query(medical_context, encoded_image)
-        
-        os.unlink(tmp_img_path)
-        
-        return analysis
-    except Exception as e:
-        st.error(f"Error processing image: {str(e)}")
+@st.cache_resource
+def prewarm_tts_cache():
+    """Synthesize the fixed system messages once per process, in the background, so speaking them is a file read"""
+    def warm():
+        for message in (DB_UNAVAILABLE_MESSAGE, NO_RESULTS_MESSAGE, TECHNICAL_ERROR_MESSAGE):
+            try:
+                synthesize_speech(message)
+            except Exception:
+                pass
+    threading.Thread(target=warm, daemon=True).start()
+    return True
+
+prewarm_tts_cache()
+
+
+def analyze_image(encoded_image, text_query):
+    """Vision model analysis of a prepared base64 JPEG (safe to call from worker threads)"""
+    medical_context = f"{text_query}\n\nProvide medical insights about this image. Be specific and educational."
+    return analyze_image_with_query(medical_context, encoded_image)
+
+
+def process_image_with_text(encoded_image, text_query, on_text=None):
+    """
+    Answer an image + question query. Vision analysis and query embedding + retrieval
+    run concurrently, then one answer grounded in both is streamed, so the wait is
+    about the slower of the two stages plus generation rather than their sum.
+    """
+    async def run_stages():
+        retrieval = asyncio.to_thread(retrieve_documents, text_query) if db else asyncio.sleep(0)
+        return await asyncio.gather(
+            asyncio.to_thread(analyze_image, encoded_image, text_query), retrieval, return_exceptions=True
+        )
+
+    analysis, retrieved = asyncio.run(run_stages())
+    if isinstance(analysis, Exception):
+        st.error(f"Error processing image: {str(analysis)}")
         return None
+    if not db or isinstance(retrieved, Exception):
+        # No literature to ground in: answer with the image analysis alone
+        if on_text:
+            on_text(analysis)
+        return analysis
+    return generate_answer(text_query, on_text=on_text, retrieved=retrieved, image_findings=analysis)
 
 
 # ====================== CUSTOM CSS ======================
@@ -602,7 +681,7 @@ else:
             ''', unsafe_allow_html=True)
             
             if "audio" in message and message["audio"]:
-                st.audio(message["audio"], format="audio/wav")
+                st.audio(message["audio"], format=AUDIO_MIME_TYPES[AUDIO_FORMAT])
 
 st.markdown('</div>', unsafe_allow_html=True)
 
@@ -797,37 +876,50 @@ if user_query and not st.session_state.get('processed_query', False):
     user_message = {"role": "user", "content": user_query}
     
     if image_to_process:
-    # Resize image to make it smaller
-        max_size = (250, 250)  # Adjust this size as needed
-        resized_image = image_to_process.copy()
-        
-        # Convert RGBA to RGB if needed (for PNG images with transparency)
-        if resized_image.mode == 'RGBA':
-            resized_image = resized_image.convert('RGB')
-        
-        resized_image.thumbnail(max_size, Image.Resampling.LANCZOS)
-        
-        buffered = io.BytesIO()
-        resized_image.save(buffered, format="JPEG", optimize=True, quality=85)
-        img_b64 = base64.b64encode(buffered.getvalue()).decode()
-        user_message["image"] = img_b64
+        # One decode gives both the bounded vision payload and the chat thumbnail
+        model_image_b64, user_message["image"] = prepare_image(image_to_process)
     
     st.session_state.messages.append(user_message)
     
+    # Streamed answer text is drawn here until the rerun below renders the full chat
+    response_placeholder = st.empty()
+
+    def show_partial_answer(text, cursor="▌"):
+        response_placeholder.markdown(f'''
+        <div class="message received">
+            <div class="message-bubble">
+                {text}{cursor}
+            </div>
+        </div>
+        ''', unsafe_allow_html=True)
+
+    # Voice queries: sentences are synthesized while the answer streams and played in order
+    speech = SentenceSpeechPipeline(synthesize_speech) if is_voice_input else None
+    playback = OrderedPlayback(speech, st.empty(), AUDIO_MIME_TYPES[AUDIO_FORMAT]) if speech else None
+
+    def on_answer_text(text):
+        show_partial_answer(text)
+        if speech:
+            speech.update(text)
+            playback.poll()
+
     with st.spinner("🤔 Thinking..."):
         if image_to_process:
-            response_text = process_image_with_text(image_to_process, user_query)
+            response_text = process_image_with_text(model_image_b64, user_query, on_text=on_answer_text)
         else:
-            response_text = generate_answer(user_query)
-        
-        assistant_message = {"role": "assistant", "content": response_text}
-        
-        if is_voice_input:
-            audio_response = generate_voice_response(response_text)
-            if audio_response:
-                assistant_message["audio"] = audio_response
-        
-        st.session_state.messages.append(assistant_message)
+            response_text = generate_answer(user_query, on_text=on_answer_text)
+    show_partial_answer(response_text, cursor="")
+
+    assistant_message = {"role": "assistant", "content": response_text}
+
+    # The spoken answer finishes playing under the final text, not under the spinner
+    if speech and response_text:
+        speech.finish(response_text)
+        playback.drain()
+        if speech.segments:
+            assistant_message["audio"] = concat_audio(speech.segments)
+
+    st.session_state.messages.append(assistant_message)
     
     # Clear all input states properly
     st.session_state.processing_voice = False
@@ -840,6 +932,26 @@ if user_query and not st.session_state.get('processed_query', False):
     st.session_state.text_input_key = f"text_input_{st.session_state.image_upload_key}"
     st.rerun()
 
+# ====================== CACHE STATS ======================
+with st.sidebar.expander("⚡ Cache stats"):
+    answer_stats = answer_cache.stats()
+    query_stats = QUERY_EMBEDDING_LRU.stats()
+    st.caption(
+        f"Answer cache: {answer_stats['hit_rate']:.0%} hit rate "
+        f"({answer_stats['hits']}/{answer_stats['hits'] + answer_stats['misses']}), "
+        f"{answer_stats['saved_seconds']:.1f}s of LLM time saved"
+    )
+    st.caption(f"Query embeddings: {query_stats['hit_rate']:.0%} hit rate, {query_stats['size']} cached")
+    st.caption(f"Speech: {TTS_CACHE.hit_rate():.0%} TTS cache hit rate")
+    if st.session_state.prompt_tokens:
+        st.caption(f"Last prompt: {st.session_state.prompt_tokens} tokens")
+    if reranker:
+        rerank_stats = reranker.stats()
+        st.caption(
+            f"Reranker: last query {rerank_stats['last_ms']:.0f} ms, "
+            f"{rerank_stats['fallback_rate']:.0%} fell back to retrieval order"
+        )
+
 # ====================== DISCLAIMER ======================
 st.markdown('''
 <div class="disclaimer">
@@ -0,0 +1,446 @@
+# memory_store.py
+import os
+import glob
+import json
+import time
+import heapq
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from chunk_store import CHUNK_STORE_FILE, PositionMap, SQLiteDocstore, chunk_key, remove_chunk_store
+
+INDEX_FILE = "index.faiss"                # Legacy / pre-versioning index file name
+VERSIONED_INDEX_FILE = "index.{}.faiss"   # One file per save; the chunk store names the committed one
+LEGACY_DOCSTORE_FILE = "index.pkl"         # Pickled InMemoryDocstore written by FAISS.save_local
+INDEX_CONFIG_FILE = "index_config.json"   # Index type + search params, next to the index
+INDEX_REPORT_FILE = "index_report.json"   # Recall vs latency of the last ANN build
+SHARD_REGISTRY_FILE = "shards.json"       # Shard name -> book title, for the sharded layout
+SHARDS_DIR = "shards"                     # One full DB (index + chunk store) per book
+SHARD_SEARCH_WORKERS = os.cpu_count() or 4
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+MIN_PQ_TRAINING = 39 * 256                # PQ codebooks need ~39 points per centroid
+RRF_K = 60                                # Reciprocal-rank-fusion damping constant
+_DIRECT_MAP_LOCK = threading.Lock()
+
+
+# ---------------- Index types ----------------
+def index_type_of(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexFlat):
+        return "flat"
+    return type(index).__name__
+
+def supports_remove(index):
+    # Only IndexFlat shifts later vectors down on remove_ids, which is what LangChain's
+    # renumbered index_to_docstore_id assumes. IVF keeps its stored labels and HNSW
+    # cannot drop vectors at all, so both are flattened before deletions and rebuilt after
+    return index_type_of(index) == "flat"
+
+def default_nlist(n):
+    """~4*sqrt(N) inverted lists, but never fewer than 39 training points per list."""
+    return max(1, min(int(4 * np.sqrt(n)), n // 39))
+
+def sample_vectors(index, size, rng):
+    ids = np.sort(rng.choice(index.ntotal, size=min(size, index.ntotal), replace=False))
+    return np.vstack([index.reconstruct(int(i)) for i in ids]).astype("float32")
+
+def flatten_index(index, batch_size=65536):
+    """Copy every vector of index into an exact IndexFlatL2 (PQ codes only give approximations)."""
+    flat = faiss.IndexFlatL2(index.d)
+    ivf_index = faiss.downcast_index(index)
+    if isinstance(ivf_index, faiss.IndexIVF):
+        ivf_index.make_direct_map()
+    for start in range(0, index.ntotal, batch_size):
+        flat.add(index.reconstruct_n(start, min(batch_size, index.ntotal - start)))
+    return flat
+
+def buildable_index_type(index_type, n):
+    """The type build_ann_index actually builds for index_type over n vectors."""
+    return "ivf_flat" if index_type == "ivf_pq" and n < MIN_PQ_TRAINING else index_type
+
+def build_ann_index(flat_index, index_type, nlist=None, hnsw_m=32, ef_construction=200, pq_m=48, seed=0):
+    """
+    Build an IVF-Flat, HNSW or IVF-PQ index holding the same vectors, in the same
+    order, as flat_index, so LangChain's index_to_docstore_id stays valid.
+    IVF quantizers are trained on a random sample of the stored vectors.
+    """
+    d, n = flat_index.d, flat_index.ntotal
+    if buildable_index_type(index_type, n) != index_type:
+        print(f"⚠️ Only {n} vectors, too few to train PQ codebooks; building ivf_flat instead")
+        index_type = buildable_index_type(index_type, n)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = nlist or default_nlist(n)
+        quantizer = faiss.IndexFlatL2(d)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, 8)
+        training_size = max(64 * nlist, MIN_PQ_TRAINING if index_type == "ivf_pq" else 0)
+        index.train(sample_vectors(flat_index, training_size, np.random.default_rng(seed)))
+    else:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+
+    for start in range(0, n, 65536):
+        index.add(flat_index.reconstruct_n(start, min(65536, n - start)))
+    return index
+
+# ---------------- Search params ----------------
+def tune_search(index, nprobe=None, ef_search=None):
+    index = faiss.downcast_index(index)
+    if nprobe and isinstance(index, faiss.IndexIVF):
+        index.nprobe = nprobe
+    if ef_search and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+def _timed_search(index, queries, k):
+    ids = np.empty((len(queries), k), dtype="int64")
+    latencies = []
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        ids[i] = index.search(query[None, :], k)[1][0]
+        latencies.append((time.perf_counter() - started) * 1000)
+    return ids, float(np.mean(latencies)), float(np.percentile(latencies, 95))
+
+def recall_latency_report(flat_index, ann_index, k=5, n_queries=200, seed=0):
+    """
+    Compare ann_index against the exact flat baseline for a sweep of nprobe /
+    efSearch values. Queries are midpoints of random pairs of stored vectors,
+    so they sit near the data without being stored vectors themselves.
+    """
+    rng = np.random.default_rng(seed)
+    queries = (sample_vectors(flat_index, n_queries, rng) + sample_vectors(flat_index, n_queries, rng)) / 2
+    truth, mean_ms, p95_ms = _timed_search(flat_index, queries, k)
+    rows = [{"index": "flat", "param": None, "value": None, "recall": 1.0, "mean_ms": mean_ms, "p95_ms": p95_ms}]
+
+    index_type = index_type_of(ann_index)
+    if index_type == "hnsw":
+        sweep = [("ef_search", value) for value in (16, 32, 64, 128, 256)]
+    else:
+        nlist = faiss.downcast_index(ann_index).nlist
+        sweep = [("nprobe", value) for value in (1, 2, 4, 8, 16, 32, 64, 128) if value <= nlist]
+
+    for param, value in sweep:
+        tune_search(ann_index, **{param: value})
+        found, mean_ms, p95_ms = _timed_search(ann_index, queries, k)
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(found, truth)])
+        rows.append({"index": index_type, "param": param, "value": value,
+                     "recall": float(recall), "mean_ms": mean_ms, "p95_ms": p95_ms})
+    return rows
+
+def pick_search_params(report, recall_target=0.95):
+    """Fastest swept setting that reaches recall_target (or the most accurate one)."""
+    candidates = [row for row in report if row["param"]]
+    if not candidates:
+        return {}
+    good = [row for row in candidates if row["recall"] >= recall_target]
+    best = min(good, key=lambda row: row["mean_ms"]) if good else max(candidates, key=lambda row: row["recall"])
+    return {best["param"]: best["value"]}
+
+# ---------------- Config + loading ----------------
+def load_index_config(path):
+    config_file = os.path.join(path, INDEX_CONFIG_FILE)
+    if not os.path.exists(config_file):
+        return {"index_type": "flat"}
+    with open(config_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_index_config(path, config):
+    with open(os.path.join(path, INDEX_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+def read_index_mmap(index_file):
+    """
+    Open a FAISS index memory-mapped and read-only, so its pages are loaded on
+    demand and shared between processes. Older faiss builds can only map IVF
+    lists; anything that cannot be mapped is read normally.
+    """
+    for flag in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+        if hasattr(faiss, flag):
+            try:
+                return faiss.read_index(index_file, getattr(faiss, flag) | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                pass
+    return faiss.read_index(index_file)
+
+def load_vectorstore(path, embedding_model, nprobe=None, ef_search=None, writable=False):
+    """
+    Load whatever index type create_memory_for_llm.py built, with its tuned search params.
+    A sharded layout (shards.json) loads as a ShardedVectorStore. Otherwise
+    readers get a memory-mapped index and a lazily queried SQLite docstore; writers
+    get a private index copy and the position map in memory. DBs still in the
+    pickled FAISS.save_local format are loaded as before and converted on next save.
+    """
+    if os.path.exists(os.path.join(path, SHARD_REGISTRY_FILE)):
+        return ShardedVectorStore.load(path, embedding_model, nprobe=nprobe, ef_search=ef_search)
+
+    chunk_file = os.path.join(path, CHUNK_STORE_FILE)
+    if os.path.exists(chunk_file) and not os.path.exists(os.path.join(path, LEGACY_DOCSTORE_FILE)):
+        docstore = SQLiteDocstore(chunk_file, read_only=not writable)
+        # The index file committed with the position map, never a newer one a crashed save left behind
+        index_file = os.path.join(path, docstore.index_file() or INDEX_FILE)
+        if writable:
+            db = FAISS(embedding_model, faiss.read_index(index_file), docstore, docstore.load_positions())
+        else:
+            db = FAISS(embedding_model, read_index_mmap(index_file), docstore, PositionMap(docstore))
+    else:
+        db = FAISS.load_local(path, embedding_model, allow_dangerous_deserialization=True)
+        if writable:
+            migrate_docstore(db, path)
+
+    config = load_index_config(path)
+    tune_search(db.index, nprobe=nprobe or config.get("nprobe"), ef_search=ef_search or config.get("ef_search"))
+    return db
+
+def migrate_docstore(db, path):
+    """Move a pickled InMemoryDocstore into the SQLite store (committed by the next save)."""
+    docstore = SQLiteDocstore(os.path.join(path, CHUNK_STORE_FILE))
+    items = list(db.docstore._dict.items())
+    for start in range(0, len(items), 10000):
+        docstore.add(dict(items[start:start + 10000]))
+    db.docstore = docstore
+
+def new_vectorstore(path, embedding_model, dim):
+    """Empty flat-index DB with a fresh SQLite docstore, for a DB that does not exist yet."""
+    os.makedirs(path, exist_ok=True)
+    chunk_file = os.path.join(path, CHUNK_STORE_FILE)
+    remove_chunk_store(chunk_file)
+    return FAISS(embedding_model, faiss.IndexFlatL2(dim), SQLiteDocstore(chunk_file), {})
+
+def save_vectorstore(db, path):
+    """
+    Write the index to a new versioned file, then commit chunk writes, the
+    position map and the name of that file in one SQLite transaction. A crash
+    before the commit leaves the previous index file and positions in force;
+    older index files (and the legacy pickle) are removed only after it.
+    """
+    os.makedirs(path, exist_ok=True)
+    if not isinstance(db.docstore, SQLiteDocstore):
+        migrate_docstore(db, path)
+    index_name = VERSIONED_INDEX_FILE.format(time.time_ns())
+    index_file = os.path.join(path, index_name)
+    faiss.write_index(db.index, index_file + ".tmp")
+    with open(index_file + ".tmp", "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(index_file + ".tmp", index_file)
+    db.docstore.save_positions(db.index_to_docstore_id, index_name)
+
+    # Readers keep their memory-mapped copy of an unlinked file until they reload
+    for stale_file in [*index_files(path), os.path.join(path, LEGACY_DOCSTORE_FILE)]:
+        if stale_file != index_file and os.path.exists(stale_file):
+            os.remove(stale_file)
+
+def index_files(path):
+    return [os.path.join(path, INDEX_FILE), *glob.glob(os.path.join(glob.escape(path), VERSIONED_INDEX_FILE.format("*")))]
+
+def vectorstore_exists(path):
+    return any(os.path.exists(f) for f in index_files(path))
+
+def index_generation(path):
+    """
+    Token that changes whenever create_memory_for_llm.py commits a save of the DB
+    at path; readers reload when it does, since their index and position map
+    must come from the same save.
+    """
+    if os.path.exists(os.path.join(path, SHARD_REGISTRY_FILE)):
+        return os.stat(os.path.join(path, SHARD_REGISTRY_FILE)).st_mtime_ns
+    chunk_file = os.path.join(path, CHUNK_STORE_FILE)
+    if os.path.exists(chunk_file):
+        return SQLiteDocstore(chunk_file, read_only=True).index_file()
+    if os.path.exists(os.path.join(path, INDEX_FILE)):
+        return os.stat(os.path.join(path, INDEX_FILE)).st_mtime_ns
+    return None
+
+def remove_vectorstore(path):
+    """Delete every index, chunk store and shard under path (caches and manifest are kept)."""
+    remove_chunk_store(os.path.join(path, CHUNK_STORE_FILE))
+    for index_file in index_files(path):
+        if os.path.exists(index_file):
+            os.remove(index_file)
+    for name in (LEGACY_DOCSTORE_FILE, INDEX_CONFIG_FILE, INDEX_REPORT_FILE, SHARD_REGISTRY_FILE):
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    shutil.rmtree(os.path.join(path, SHARDS_DIR), ignore_errors=True)
+
+# ---------------- MMR diversification ----------------
+def reconstruct_vectors(index, positions):
+    """Stored vectors at positions (approximate for PQ); IVF indexes get a direct map on first use."""
+    positions = np.asarray(positions, dtype="int64")
+    ivf_index = faiss.downcast_index(index)
+    if isinstance(ivf_index, faiss.IndexIVF) and ivf_index.direct_map.no():
+        with _DIRECT_MAP_LOCK:
+            if ivf_index.direct_map.no():
+                ivf_index.make_direct_map()
+    return index.reconstruct_batch(positions)
+
+def mmr_select(query_vector, vectors, k, lambda_mult=0.5):
+    """
+    Greedy maximal marginal relevance over cosine similarity: row indices of
+    vectors, in pick order. lambda_mult=1 is pure relevance, 0 pure diversity.
+    All pairwise similarities come from one matrix product.
+    """
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype="float32")
+    relevance = vectors @ (query / (np.linalg.norm(query) or 1.0))
+    similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    for _ in range(min(k, len(vectors)) - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return selected
+
+def mmr_search_by_vector(db, query_vector, k, fetch_k=20, lambda_mult=0.5):
+    """
+    Fetch the fetch_k nearest chunks, then keep k of them by MMR using the
+    vectors stored in the FAISS index (nothing is re-embedded). Works on a
+    single DB and on a ShardedVectorStore; returns (Document, L2 distance) pairs.
+    """
+    query = np.array([query_vector], dtype="float32")
+
+    def search_store(store):
+        distances, positions = store.index.search(query, fetch_k)
+        return [(float(d), store, int(p)) for d, p in zip(distances[0], positions[0]) if p != -1]
+
+    # Shards are searched concurrently on the store's pool, as in similarity search
+    if isinstance(db, ShardedVectorStore):
+        hits = [hit for store_hits in db._executor.map(search_store, db.shards) for hit in store_hits]
+    else:
+        hits = search_store(db)
+    hits = heapq.nsmallest(fetch_k, hits, key=lambda hit: hit[0])
+    if not hits:
+        return []
+
+    try:
+        vectors = np.empty((len(hits), query.shape[1]), dtype="float32")
+        rows_by_store = {}
+        for row, (_, store, _) in enumerate(hits):
+            rows_by_store.setdefault(id(store), (store, []))[1].append(row)
+        for store, rows in rows_by_store.values():
+            vectors[rows] = reconstruct_vectors(store.index, [hits[row][2] for row in rows])
+        order = mmr_select(query_vector, vectors, k, lambda_mult)
+    except RuntimeError:
+        order = range(min(k, len(hits)))     # Index type without reconstruction: plain nearest-first
+    results = []
+    for i in order:
+        distance, store, pos = hits[i]
+        results.append((store.docstore.search(store.index_to_docstore_id[pos]), distance))
+    return results
+
+# ---------------- Hybrid retrieval ----------------
+def lexical_search(db, query, k):
+    """
+    BM25 hits as (Document, score) pairs, best first; a sharded DB returns the
+    shards' lists fused by rank (RRF scores). Empty for DBs without an inverted index.
+    """
+    if isinstance(db, ShardedVectorStore):
+        return db.lexical_search(query, k)
+    if hasattr(db.docstore, "lexical_search"):
+        return db.docstore.lexical_search(query, k)
+    return []
+
+def reciprocal_rank_fusion(ranked_lists, k, rrf_k=RRF_K):
+    """Merge ranked Document lists: each chunk scores sum(1 / (rrf_k + rank)) over the lists it appears in."""
+    scores, docs = {}, {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked, start=1):
+            key = chunk_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    return [(docs[key], score) for key, score in heapq.nlargest(k, scores.items(), key=lambda item: item[1])]
+
+def hybrid_search(db, query, query_vector, k, fetch_k=20, rrf_k=RRF_K, mmr_lambda=None):
+    """
+    Dense + BM25 retrieval fused with RRF. Exact terms (drug names, dosages,
+    ICD codes) the embedding blurs still reach the top k through the lexical list.
+    With mmr_lambda the dense list is diversified by MMR over 2 * fetch_k hits.
+    Returns (Document, fused score) pairs, best first.
+    """
+    if mmr_lambda is None:
+        dense = db.similarity_search_by_vector(query_vector, k=fetch_k)
+    else:
+        dense = [doc for doc, _ in mmr_search_by_vector(db, query_vector, fetch_k, 2 * fetch_k, mmr_lambda)]
+    lexical = [doc for doc, _ in lexical_search(db, query, fetch_k)]
+    return reciprocal_rank_fusion([dense, lexical], k, rrf_k)
+
+# ---------------- Sharded layout ----------------
+def load_shard_registry(path):
+    registry_file = os.path.join(path, SHARD_REGISTRY_FILE)
+    if not os.path.exists(registry_file):
+        return {}
+    with open(registry_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_shard_registry(path, registry):
+    registry_file = os.path.join(path, SHARD_REGISTRY_FILE)
+    with open(registry_file + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(registry, f, indent=2)
+    os.replace(registry_file + ".tmp", registry_file)
+
+class ShardedVectorStore:
+    """
+    Read-only view over one FAISS DB per book. A query is embedded once, every
+    shard index is searched on a thread pool (faiss releases the GIL), and only
+    the merged top-k hits are fetched from their shard's chunk store.
+    Implements the similarity_search* methods medibot.py and
+    connect_memory_with_llm.py use on a LangChain FAISS store.
+    """
+
+    def __init__(self, shards, embedding_model, workers=SHARD_SEARCH_WORKERS):
+        self.shards = shards
+        self.embedding_function = embedding_model
+        self._executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(shards))))
+
+    @classmethod
+    def load(cls, path, embedding_model, nprobe=None, ef_search=None):
+        registry = load_shard_registry(path)
+        shards = [
+            load_vectorstore(os.path.join(path, SHARDS_DIR, name), embedding_model, nprobe=nprobe, ef_search=ef_search)
+            for name in sorted(registry)
+        ]
+        return cls(shards, embedding_model)
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        query = np.array([embedding], dtype="float32")
+
+        def search_shard(shard_no):
+            distances, positions = self.shards[shard_no].index.search(query, k)
+            return [(float(d), shard_no, int(p)) for d, p in zip(distances[0], positions[0]) if p != -1]
+
+        # All shards use L2 distance, so scores are directly comparable: lower is better
+        hits = heapq.nsmallest(k, (hit for hits in self._executor.map(search_shard, range(len(self.shards))) for hit in hits))
+        results = []
+        for distance, shard_no, pos in hits:
+            shard = self.shards[shard_no]
+            results.append((shard.docstore.search(shard.index_to_docstore_id[pos]), distance))
+        return results
+
+    def lexical_search(self, query, k):
+        # BM25 statistics are per shard, so shard lists are fused by rank, not by raw score
+        hits = self._executor.map(lambda shard: shard.docstore.lexical_search(query, k), self.shards)
+        return reciprocal_rank_fusion([[doc for doc, _ in shard_hits] for shard_hits in hits], k)
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
@@ -0,0 +1,114 @@
+# provider_gateway.py
+import os
+import time
+import random
+import functools
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import httpx
+import groq
+
+# ---------------- CONFIG ----------------
+GROQ_DEADLINE = 60.0        # Seconds a Groq call may take, retries included
+TTS_DEADLINE = 30.0         # Seconds an ElevenLabs call may take, retries included
+MAX_RETRIES = 3             # Extra attempts after a 429, 5xx or connection error
+BACKOFF_BASE = 0.5          # Seconds; attempt n waits uniform(0, BACKOFF_BASE * 2**n)
+BACKOFF_CAP = 8.0
+HEDGE_AFTER = None          # Seconds before a duplicate of a slow idempotent call is sent (None = off)
+POOL_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=120)
+
+_hedge_executor = ThreadPoolExecutor(max_workers=8)
+
+
+# ---------------- Pooled clients ----------------
+@functools.lru_cache(maxsize=None)
+def http_client():
+    """Process-wide keep-alive connection pool shared by every provider client."""
+    return httpx.Client(limits=POOL_LIMITS, timeout=httpx.Timeout(GROQ_DEADLINE, connect=10.0))
+
+@functools.lru_cache(maxsize=None)
+def groq_client(api_key=None):
+    # Retries are done here (with jitter and a deadline), not by the SDK
+    return groq.Groq(api_key=api_key or os.getenv("GROQ_API_KEY"), http_client=http_client(), max_retries=0)
+
+@functools.lru_cache(maxsize=None)
+def elevenlabs_client(api_key=None):
+    from elevenlabs.client import ElevenLabs
+    return ElevenLabs(api_key=api_key or os.getenv("ELEVENLABS_API_KEY"), httpx_client=http_client())
+
+
+# ---------------- Deadlines, retries and hedging ----------------
+def is_retryable(error):
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (groq.APIConnectionError, httpx.TransportError, TimeoutError))
+
+def retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def _hedged(fn, timeout, hedge_after):
+    """Run fn; if it has not finished after hedge_after seconds, race a second copy and keep the first success."""
+    first = _hedge_executor.submit(fn, timeout)
+    if wait([first], timeout=hedge_after).done:
+        return first.result()
+    second = _hedge_executor.submit(fn, max(timeout - hedge_after, 1.0))
+    pending = {first, second}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None or not pending:
+                return future.result()
+
+def call_with_retry(fn, deadline, retries=MAX_RETRIES, hedge_after=None):
+    """
+    Call fn(timeout) until it succeeds, retrying 429/5xx/connection errors with
+    full-jitter exponential backoff (or the server's Retry-After). Each attempt
+    gets the time left before the overall deadline as its timeout.
+    """
+    expires = time.monotonic() + deadline
+    for attempt in range(retries + 1):
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Provider call exceeded its {deadline:.0f}s deadline")
+        try:
+            return _hedged(fn, remaining, hedge_after) if hedge_after else fn(remaining)
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            delay = retry_after(e) or random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            if time.monotonic() + delay >= expires:
+                raise
+            time.sleep(delay)
+
+
+# ---------------- Provider calls ----------------
+def chat_completion(deadline=GROQ_DEADLINE, hedge_after=HEDGE_AFTER, api_key=None, **request):
+    """Groq chat completion; streamed completions are retried until the stream opens, never hedged."""
+    client = groq_client(api_key)
+    return call_with_retry(
+        lambda timeout: client.chat.completions.create(timeout=timeout, **request),
+        deadline, hedge_after=None if request.get("stream") else hedge_after
+    )
+
+def transcribe(file, model, deadline=GROQ_DEADLINE, hedge_after=HEDGE_AFTER, api_key=None, **request):
+    """Groq speech-to-text; file is a (filename, bytes) pair so every attempt can resend it."""
+    client = groq_client(api_key)
+    return call_with_retry(
+        lambda timeout: client.audio.transcriptions.create(file=file, model=model, timeout=timeout, **request),
+        deadline, hedge_after=hedge_after
+    )
+
+def text_to_speech(text, voice_id, model_id, deadline=TTS_DEADLINE, hedge_after=HEDGE_AFTER, api_key=None, **request):
+    """ElevenLabs TTS; returns the complete audio (mp3 by default) as bytes."""
+    client = elevenlabs_client(api_key)
+    return call_with_retry(
+        lambda timeout: b"".join(client.text_to_speech.convert(
+            voice_id=voice_id, model_id=model_id, text=text,
+            request_options={"timeout_in_seconds": max(1, int(timeout))}, **request
+        )),
+        deadline, hedge_after=hedge_after
+    )
@@ -0,0 +1,87 @@
+# reranker.py
+import time
+
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_BATCH_SIZE = 16
+RERANK_BUDGET_MS = 200      # Per-query limit; past it the candidates keep their retrieval order
+RERANK_MAX_LENGTH = 256     # Query + chunk tokens scored per pair
+RERANK_PROBE_EVERY = 10     # While the estimate says nothing fits, re-measure on one pair every this many queries
+
+
+class CrossEncoderReranker:
+    """
+    Re-score retrieved (Document, score) candidates with a small local
+    cross-encoder on CPU and keep the best k. The budget is hard: the model is
+    loaded and warmed up once at construction, batches are sized from the
+    measured per-pair cost, a batch that would not finish in time is not
+    started, and a query that still overruns is discarded. In any of those
+    cases, or if the model cannot be loaded, the candidates are returned in
+    their original (bi-encoder / fused) order instead.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, batch_size=RERANK_BATCH_SIZE,
+                 budget_ms=RERANK_BUDGET_MS, max_length=RERANK_MAX_LENGTH):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.max_length = max_length
+        self.model = None
+        self.pair_ms = 0.0      # Moving average of the cost of scoring one pair
+        self.reranked = 0
+        self.fallbacks = 0
+        self.last_ms = 0.0
+        try:
+            from sentence_transformers import CrossEncoder
+            self.model = CrossEncoder(model_name, device="cpu", max_length=max_length)
+            # Warm-up on a full batch of max-length pairs: the first call pays one-time
+            # setup, so only the second one measures the per-pair cost
+            warmup = [("word " * max_length, "word " * max_length)] * batch_size
+            self.model.predict(warmup, batch_size=batch_size, show_progress_bar=False)
+            self._predict(warmup)
+        except Exception as e:
+            self.model = None
+            print(f"⚠️ Reranker disabled ({model_name}): {e}")
+
+    def _predict(self, pairs):
+        started = time.perf_counter()
+        scores = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        pair_ms = (time.perf_counter() - started) * 1000 / len(pairs)
+        self.pair_ms = pair_ms if not self.pair_ms else 0.8 * self.pair_ms + 0.2 * pair_ms
+        return scores
+
+    def _score(self, query, docs_and_scores, deadline):
+        # Batches no larger than what the per-pair cost says fits in the budget
+        batch_size = max(1, min(self.batch_size, int(self.budget_ms / max(self.pair_ms, 1e-3))))
+        scores = []
+        for start in range(0, len(docs_and_scores), batch_size):
+            batch = docs_and_scores[start:start + batch_size]
+            if time.perf_counter() + len(batch) * self.pair_ms / 1000 > deadline:
+                if not scores and self.fallbacks % RERANK_PROBE_EVERY == 0:
+                    # A single pair re-measures the cost, so a stale high estimate cannot disable reranking for good
+                    self.pair_ms = 0.0
+                    self._predict([(query, docs_and_scores[0][0].page_content)])
+                return None
+            scores.extend(self._predict([(query, doc.page_content) for doc, _ in batch]))
+        return scores if time.perf_counter() <= deadline else None
+
+    def rerank(self, query, docs_and_scores, k):
+        """Return the top k (Document, score) pairs; scores are cross-encoder logits unless it fell back."""
+        started = time.perf_counter()
+        scores = None
+        if self.model is not None and docs_and_scores:
+            scores = self._score(query, docs_and_scores, started + self.budget_ms / 1000)
+        self.last_ms = (time.perf_counter() - started) * 1000
+
+        if not scores:
+            self.fallbacks += 1
+            return docs_and_scores[:k]
+        self.reranked += 1
+        ranked = sorted(zip(docs_and_scores, scores), key=lambda item: item[1], reverse=True)
+        return [(doc, float(score)) for (doc, _), score in ranked[:k]]
+
+    def stats(self):
+        total = self.reranked + self.fallbacks
+        return {
+            "reranked": self.reranked, "fallbacks": self.fallbacks, "last_ms": self.last_ms,
+            "fallback_rate": self.fallbacks / total if total else 0.0,
+        }
@@ -0,0 +1,164 @@
+# speech_pipeline.py
+import io
+import re
+import base64
+import time
+import wave
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+TTS_WORKERS = 3             # Sentences synthesized at the same time
+MIN_SEGMENT_CHARS = 40      # Short sentences are joined so each TTS call carries a useful amount of speech
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+MP3_BITRATES_KBPS = {   # Layer III bitrate tables, by MPEG version
+    "1": (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    "2": (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+
+def _skip_id3(audio):
+    # ID3v2 tag: "ID3", version (2 bytes), flags, then a 4-byte syncsafe size
+    if audio[:3] == b"ID3" and len(audio) >= 10:
+        size = (audio[6] << 21) | (audio[7] << 14) | (audio[8] << 7) | audio[9]
+        return 10 + size
+    return 0
+
+
+def mp3_seconds(audio):
+    """Duration of a constant-bitrate mp3 from its first frame header, without decoding."""
+    start = _skip_id3(audio)
+    for i in range(start, len(audio) - 3):
+        if audio[i] == 0xFF and audio[i + 1] & 0xE0 == 0xE0:
+            version = "1" if (audio[i + 1] >> 3) & 3 == 3 else "2"
+            kbps = MP3_BITRATES_KBPS[version][audio[i + 2] >> 4] if audio[i + 2] >> 4 < 15 else 0
+            if kbps:
+                return (len(audio) - i) * 8 / (kbps * 1000)
+    return len(audio) * 8 / 128000     # No readable header: assume 128 kbps
+
+
+def segment_seconds(audio):
+    if audio[:4] != b"RIFF":
+        return mp3_seconds(audio)
+    with wave.open(io.BytesIO(audio)) as wav:
+        return wav.getnframes() / wav.getframerate()
+
+
+def concat_audio(segments):
+    """
+    Join segments into one clip. MP3 is a plain sequence of frames, so mp3
+    segments are joined byte-wise (minus repeated ID3 tags) with no transcode;
+    wav segments are decoded and re-exported.
+    """
+    if segments and segments[0][:4] != b"RIFF":
+        return segments[0] + b"".join(audio[_skip_id3(audio):] for audio in segments[1:])
+    from pydub import AudioSegment
+    combined = AudioSegment.empty()
+    for audio in segments:
+        combined += AudioSegment.from_file(io.BytesIO(audio), format="wav")
+    buffer = io.BytesIO()
+    combined.export(buffer, format="wav")
+    return buffer.getvalue()
+
+
+class SentenceSpeechPipeline:
+    """
+    Speak an answer while it is still being written. update() takes the text
+    so far and sends each newly completed sentence to synthesize() on a worker
+    pool; next_segment() hands the audio back in sentence order, so the first
+    sentence can play while later ones are still being generated.
+    """
+
+    def __init__(self, synthesize, workers=TTS_WORKERS, min_chars=MIN_SEGMENT_CHARS):
+        self.synthesize = synthesize
+        self.min_chars = min_chars
+        self.segments = []          # Audio delivered so far, in order
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._futures = deque()
+        self._submitted = ""        # Prefix of the text already sent for synthesis
+        self._streamed = ""         # Text passed to the last update()
+        self._finished = False
+
+    def _submit(self, sentence):
+        if sentence.strip():
+            self._futures.append(self._executor.submit(self.synthesize, sentence.strip()))
+
+    def update(self, text):
+        self._streamed = text
+        if not text.startswith(self._submitted):
+            return
+        # Everything up to the last sentence break followed by whitespace is complete
+        pending = text[len(self._submitted):]
+        breaks = [match.end() for match in SENTENCE_END_RE.finditer(pending)]
+        start = 0
+        for end in breaks:
+            if end - start >= self.min_chars:
+                self._submit(pending[start:end])
+                start = end
+        self._submitted += pending[:start]
+
+    def finish(self, text):
+        """
+        Speak the rest of the final text. A final text that is just the streamed
+        one stripped continues from the streamed text; one that does not extend
+        what was already spoken (e.g. an error message after a partial stream)
+        is spoken in full.
+        """
+        if text == self._streamed.strip():
+            text = self._streamed
+        self._submit(text[len(self._submitted):] if text.startswith(self._submitted) else text)
+        self._submitted = text
+        self._finished = True
+        self._executor.shutdown(wait=False)
+
+    def next_segment(self, block=False):
+        """Next audio segment in order, or None if it is not ready yet (or, once finished, if there is none left)."""
+        while self._futures:
+            if not block and not self._futures[0].done():
+                return None
+            try:
+                audio = self._futures.popleft().result()
+            except Exception as e:
+                print(f"⚠️ TTS failed for one sentence: {e}")
+                continue
+            if audio:
+                self.segments.append(audio)
+                return audio
+        return None
+
+
+class OrderedPlayback:
+    """Play pipeline segments one after another in a Streamlit placeholder, each after the previous one ends."""
+
+    def __init__(self, pipeline, placeholder, audio_format="audio/mpeg"):
+        self.pipeline = pipeline
+        self.placeholder = placeholder
+        self.audio_format = audio_format
+        self.playing_until = 0.0
+
+    def _play(self, audio):
+        time.sleep(max(0.0, self.playing_until - time.time()))
+        # A raw <audio autoplay> element: the pinned Streamlit's st.audio cannot autoplay
+        self.placeholder.markdown(
+            f'<audio autoplay src="data:{self.audio_format};base64,{base64.b64encode(audio).decode()}"></audio>',
+            unsafe_allow_html=True
+        )
+        self.playing_until = time.time() + segment_seconds(audio)
+
+    def poll(self):
+        # Non-blocking: called between streamed tokens
+        while time.time() >= self.playing_until:
+            audio = self.pipeline.next_segment()
+            if audio is None:
+                return
+            self._play(audio)
+
+    def drain(self):
+        # Blocks until the last segment has finished playing, so a rerun does not cut it off
+        while True:
+            audio = self.pipeline.next_segment(block=True)
+            if audio is None:
+                break
+            self._play(audio)
+        time.sleep(max(0.0, self.playing_until - time.time()))
@@ -0,0 +1,88 @@
+# tts_cache.py
+import os
+import re
+import hashlib
+import threading
+
+TTS_CACHE_DIR = "vectorstore/tts_cache"
+TTS_CACHE_MAX_BYTES = 512 * 1024 ** 2   # Evict least recently used clips above this size
+
+
+def speech_key(provider, voice_id, model, text, audio_format):
+    normalized = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha256("\0".join((provider, voice_id, model, audio_format, normalized)).encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Content-addressed on-disk audio cache: one file per (provider, voice, model,
+    format, normalized text). A hit refreshes the file's mtime, and the oldest
+    files are deleted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def _path(self, key, audio_format):
+        return os.path.join(self.directory, f"{key}.{audio_format}")
+
+    def get(self, key, audio_format):
+        path = self._path(key, audio_format)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return audio
+
+    def put(self, key, audio_format, audio):
+        path = self._path(key, audio_format)
+        with self._lock:
+            existed = os.path.exists(path)
+            with open(path + ".tmp", "wb") as f:
+                f.write(audio)
+            os.replace(path + ".tmp", path)
+            if not existed:
+                self.total_bytes += len(audio)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop the least recently used clips until the cache is back under 90% of its budget
+        entries = sorted((e for e in os.scandir(self.directory) if e.is_file()), key=lambda e: e.stat().st_mtime)
+        self.total_bytes = sum(e.stat().st_size for e in entries)
+        for entry in entries:
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            self.total_bytes -= size
+
+    def cached(self, provider, voice_id, model, audio_format, synthesize, text):
+        """Return cached audio for text, calling synthesize(text) and storing the result on a miss."""
+        key = speech_key(provider, voice_id, model, text, audio_format)
+        audio = self.get(key, audio_format)
+        if audio is None:
+            audio = synthesize(text)
+            self.put(key, audio_format, audio)
+        return audio
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+# Shared by every TTS call in the process
+TTS_CACHE = TTSCache()
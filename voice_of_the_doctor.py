@@ -1,42 +1,58 @@
 # voice_of_the_doctor.py
+import io
 import os
 from pydub import AudioSegment
+import provider_gateway
+from tts_cache import TTS_CACHE
 
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 
+def transcode_audio(audio: bytes, from_format: str, to_format: str) -> bytes:
+    """Convert audio between formats in memory; only needed for clients that cannot play the provider's mp3."""
+    if from_format == to_format:
+        return audio
+    sound = AudioSegment.from_file(io.BytesIO(audio), format=from_format)
+    buffer = io.BytesIO()
+    sound.export(buffer, format=to_format)
+    return buffer.getvalue()
+
+def text_to_speech_bytes_with_elevenlabs(input_text: str, voice_id: str = "2qfp6zPuviqeCOZIE9RZ",
+                                         audio_format: str = "mp3") -> bytes:
+    """
+    Generate TTS via ElevenLabs and return audio bytes, mp3 as delivered by ElevenLabs unless
+    another audio_format is asked for. If ElevenLabs isn't available, raise an error and let caller fallback.
+    """
+    if not ELEVENLABS_API_KEY:
+        raise RuntimeError("ELEVENLABS_API_KEY not set.")
+
+    def synthesize(text):
+        # Pooled ElevenLabs client with deadline + retry, see provider_gateway.py
+        return provider_gateway.text_to_speech(text, voice_id, "eleven_turbo_v2", api_key=ELEVENLABS_API_KEY)
+
+    audio = TTS_CACHE.cached("elevenlabs", voice_id, "eleven_turbo_v2", "mp3", synthesize, input_text)
+    return transcode_audio(audio, "mp3", audio_format)
+
 def text_to_speech_with_elevenlabs(input_text: str, output_filepath: str, voice_id: str = "2qfp6zPuviqeCOZIE9RZ"):
     """
     Generate TTS via ElevenLabs and write a wav file to output_filepath.
     If ElevenLabs isn't available, raise an error and let caller fallback.
     """
-    if not ELEVENLABS_API_KEY:
-        raise RuntimeError("ELEVENLABS_API_KEY not set.")
-    # using the ElevenLabs API client (user snippet style)
-    from elevenlabs.client import ElevenLabs
-    from elevenlabs import save as eleven_save
-
-    client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-    stream = client.text_to_speech.convert(voice_id=voice_id, model_id="eleven_turbo_v2", text=input_text)
-    tmp_mp3 = output_filepath + ".mp3"
-    eleven_save(stream, tmp_mp3)
-    sound = AudioSegment.from_mp3(tmp_mp3)
-    sound.export(output_filepath, format="wav")
-    try:
-        os.remove(tmp_mp3)
-    except Exception:
-        pass
+    with open(output_filepath, "wb") as f:
+        f.write(text_to_speech_bytes_with_elevenlabs(input_text, voice_id, audio_format="wav"))
     return output_filepath
 
 # fallback using gTTS
 from gtts import gTTS
+def text_to_speech_bytes_with_gtts(input_text: str, audio_format: str = "mp3") -> bytes:
+    def synthesize(text):
+        mp3_buffer = io.BytesIO()
+        gTTS(text=text, lang="en", slow=False).write_to_fp(mp3_buffer)
+        return mp3_buffer.getvalue()
+
+    audio = TTS_CACHE.cached("gtts", "en", "gtts", "mp3", synthesize, input_text)
+    return transcode_audio(audio, "mp3", audio_format)
+
 def text_to_speech_with_gtts(input_text: str, output_filepath: str):
-    temp_mp3 = output_filepath + ".mp3"
-    tts = gTTS(text=input_text, lang="en", slow=False)
-    tts.save(temp_mp3)
-    sound = AudioSegment.from_mp3(temp_mp3)
-    sound.export(output_filepath, format="wav")
-    try:
-        os.remove(temp_mp3)
-    except Exception:
-        pass
+    with open(output_filepath, "wb") as f:
+        f.write(text_to_speech_bytes_with_gtts(input_text, audio_format="wav"))
     return output_filepath
@@ -1,20 +1,23 @@
 # voice_of_the_patient.py
 import os
+import provider_gateway
 
 def transcribe_with_groq(GROQ_API_KEY: str, audio_filepath: str, stt_model: str = "whisper-large-v3") -> str:
     """
     Uploads local audio file to Groq STT endpoint and returns the transcription text.
     """
-    from groq import Groq
+    with open(audio_filepath, "rb") as f:
+        return transcribe_bytes_with_groq(GROQ_API_KEY, f.read(), os.path.basename(audio_filepath), stt_model)
+
+def transcribe_bytes_with_groq(GROQ_API_KEY: str, audio_bytes: bytes, filename: str = "audio.wav",
+                               stt_model: str = "whisper-large-v3") -> str:
+    """
+    Sends in-memory audio to Groq STT and returns the transcription text.
+    filename only tells the endpoint the audio format.
+    """
     if not GROQ_API_KEY:
         raise RuntimeError("GROQ_API_KEY missing in environment.")
-    client = Groq(api_key=GROQ_API_KEY)
-    with open(audio_filepath, "rb") as f:
-        transcription = client.audio.transcriptions.create(
-            model=stt_model,
-            file=f,
-            language="en"
-        )
+    transcription = provider_gateway.transcribe((filename, audio_bytes), stt_model, api_key=GROQ_API_KEY, language="en")
     # Groq might return object-like or dict-like
     if hasattr(transcription, "text"):
         return transcription.text